@@ -2,7 +2,8 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.utils.translation import gettext_lazy as _
 
-from .models import User
+from .blind_index import search_q
+from .models import User, ENCRYPTED_FIELDS
 
 
 class CustomUserAdmin(UserAdmin):
@@ -36,8 +37,20 @@ class CustomUserAdmin(UserAdmin):
     list_display = ("username", "email",
                     "first_name", "last_name",
                     "is_staff", "is_superuser")
-    search_fields = ("username", "email", "first_name", "last_name")
-    ordering = ("username", "email",)
+    # encrypted fields are searched by their blind indexes, see get_search_results()
+    search_fields = ("username",)
+    # ordering by an encrypted field would decrypt all the rows (and "username" is unique)
+    ordering = ("username",)
+
+    def get_queryset(self, request):
+        # encrypted fields are listed, so load them at once (see LeanUserManager)
+        return super().get_queryset(request).defer(None)
+
+    def get_search_results(self, request, queryset, search_term):
+        res, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            res |= queryset.filter(search_q(ENCRYPTED_FIELDS, search_term))
+        return res, may_have_duplicates
 
 
 admin.site.register(User, CustomUserAdmin)
@@ -0,0 +1,61 @@
+# Blind indexes of the encrypted fields of the Users: keyed hashes (HMAC) of their normalized values,
+# so that they can be searched by exact value or by prefix without decrypting every row.
+# The key is CUSTOM_USER_BLIND_INDEX_KEY (if not set, derived from SECRET_KEY): changing it
+# requires running the "build_blind_indexes" command.
+import re
+import unicodedata
+from django.conf import settings
+from django.db.models import Q
+from django.utils.crypto import salted_hmac
+
+# prefixes shorter than this are too common (and leak too much) to be indexed
+MIN_PREFIX = 3
+# longer prefixes are not indexed, so longer terms only match on their first MAX_PREFIX characters
+MAX_PREFIX = 16
+
+
+def normalize(value):
+    # case, accents and spacing do not matter when searching
+    value = unicodedata.normalize('NFKD', value or '')
+    value = ''.join(x for x in value if not unicodedata.combining(x))
+    return ' '.join(value.casefold().split())
+
+
+def digest(name, value):
+    # a different key for each field, so that equal values of different fields do not match
+    secret = getattr(settings, 'CUSTOM_USER_BLIND_INDEX_KEY', None) or settings.SECRET_KEY
+    return salted_hmac(f'custom_user.blind_index.{name}', value, secret=secret,
+                       algorithm='sha256').hexdigest()
+
+
+def exact_index(name, value):
+    # None for empty values, that must not match each other
+    value = normalize(value)
+    return digest(name, value) if value else None
+
+
+def prefix_indexes(name, value):
+    # prefixes of the whole value and of each of its words (ie: also "rossi" for "mario.rossi@example.com")
+    value = normalize(value)
+    words = {value, *re.split(r'[\s.@_+-]+', value)}
+    prefixes = {word[:length] for word in words
+                for length in range(MIN_PREFIX, min(len(word), MAX_PREFIX) + 1)}
+    return {digest(name, prefix) for prefix in prefixes}
+
+
+def search_q(names, term, prefix=''):
+    """
+    Return the condition matching the Users (or the objects related to them by "prefix",
+    ie: "user__") whose fields in "names" are equal to "term", or start with it.
+    """
+    from .models import UserSearchTerm
+    value = normalize(term)
+    if not value:
+        return Q(pk__in=[])
+    res = Q()
+    for name in names:
+        res |= Q(**{f'{prefix}{name}_bidx': digest(name, value)})
+    if len(value) >= MIN_PREFIX:
+        digests = [digest(name, value[:MAX_PREFIX]) for name in names]
+        res |= Q(**{f'{prefix}pk__in': UserSearchTerm.objects.filter(digest__in=digests).values('user_id')})
+    return res
@@ -0,0 +1,44 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from custom_user.blind_index import exact_index, prefix_indexes
+from custom_user.models import User, UserSearchTerm, ENCRYPTED_FIELDS
+
+
+class Command(BaseCommand):
+    help = "Build the blind indexes of the encrypted fields of all the Users " \
+        "(ie: the existing ones, or after changing CUSTOM_USER_BLIND_INDEX_KEY)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of Users processed at a time')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        queryset = User.objects.defer(None).order_by('pk')
+        count = terms = 0
+        last_pk = None
+        start = time.perf_counter()
+        while True:
+            # by keyset, so that each chunk is a short transaction
+            chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            users = list(chunk[:chunk_size])
+            if not users:
+                break
+            last_pk = users[-1].pk
+            items = []
+            for user in users:
+                for name in ENCRYPTED_FIELDS:
+                    value = getattr(user, name)
+                    setattr(user, f'{name}_bidx', exact_index(name, value))
+                    items.extend(UserSearchTerm(user=user, field=name, digest=x)
+                                 for x in prefix_indexes(name, value))
+            with transaction.atomic():
+                User.objects.bulk_update(users, [f'{name}_bidx' for name in ENCRYPTED_FIELDS])
+                UserSearchTerm.objects.filter(user__in=users).delete()
+                UserSearchTerm.objects.bulk_create(items)
+            count += len(users)
+            terms += len(items)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'Indexed {count} users ({terms} prefix terms) in {elapsed:.1f}s '
+                          f'({count / elapsed if elapsed else 0:.0f} users/s)')
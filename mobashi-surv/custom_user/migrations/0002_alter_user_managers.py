@@ -0,0 +1,20 @@
+# Generated by Django 4.2.5 on 2026-10-18 07:52
+
+import custom_user.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("custom_user", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name="user",
+            managers=[
+                ("objects", custom_user.models.LeanUserManager()),
+            ],
+        ),
+    ]
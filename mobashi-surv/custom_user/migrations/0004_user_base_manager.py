@@ -0,0 +1,21 @@
+# Generated by Django 4.2.5 on 2026-10-18 08:06
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("custom_user", "0003_user_blind_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="user",
+            options={
+                "base_manager_name": "objects",
+                "verbose_name": "user",
+                "verbose_name_plural": "users",
+            },
+        ),
+    ]
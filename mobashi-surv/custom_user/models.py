@@ -1,7 +1,28 @@
-from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.contrib.auth.models import AbstractUser, UserManager
+from django.db import models, transaction
 from django.utils.translation import gettext_lazy as _
 from pgcrypto import fields
+from . import blind_index
+
+
+# decrypted by the database (with pgp_pub_decrypt) every time they are loaded
+ENCRYPTED_FIELDS = ['first_name', 'last_name', 'email']
+
+
+class LeanUserQuerySet(models.QuerySet):
+    def only(self, *fields):
+        # only() would keep the encrypted fields deferred by LeanUserManager, even if among "fields"
+        # (and load all the other ones instead), ie: when refresh_from_db() loads a deferred one
+        return super(LeanUserQuerySet, self.defer(None)).only(*fields)
+
+
+class LeanUserManager(UserManager):
+    # Do not load the encrypted fields, unless they are accessed (see User.refresh_from_db()),
+    # so that authentication, enrollment, etc. do not pay for decrypting them.
+    # Use .defer(None) to load them at once (ie: when listing Users with their names).
+    # Also the base manager of User, so that related objects (ie: "survey.user") are lean too.
+    def get_queryset(self):
+        return LeanUserQuerySet(self.model, using=self._db).defer(*ENCRYPTED_FIELDS)
 
 
 class User(AbstractUser):
@@ -23,3 +44,62 @@ class User(AbstractUser):
     last_name = fields.CharPGPPublicKeyField(
         _("last name"), max_length=150, blank=True)
     email = fields.EmailPGPPublicKeyField(_("email address"), blank=True)
+    # blind indexes of the encrypted fields, to search them (see blind_index.py)
+    first_name_bidx = models.CharField(max_length=64, null=True, blank=True, editable=False, db_index=True)
+    last_name_bidx = models.CharField(max_length=64, null=True, blank=True, editable=False, db_index=True)
+    email_bidx = models.CharField(max_length=64, null=True, blank=True, editable=False, db_index=True)
+
+    objects = LeanUserManager()
+
+    class Meta(AbstractUser.Meta):
+        base_manager_name = 'objects'
+
+    def save(self, *args, **kwargs):
+        # keep the blind indexes of the encrypted fields being saved (if loaded) in sync
+        adding = self._state.adding
+        update_fields = kwargs.get('update_fields', None)
+        deferred = self.get_deferred_fields()
+        changed = []
+        for name in ENCRYPTED_FIELDS:
+            if name in deferred or (update_fields is not None and name not in update_fields):
+                continue
+            value = blind_index.exact_index(name, getattr(self, name))
+            if value != getattr(self, f'{name}_bidx') or (adding and value):
+                setattr(self, f'{name}_bidx', value)
+                changed.append(name)
+        if not changed:
+            super().save(*args, **kwargs)
+            return
+        if update_fields is not None:
+            kwargs['update_fields'] = [*update_fields, *[f'{name}_bidx' for name in changed]]
+        # all or nothing, so that the User is never found by the search terms of its old values
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            self.refresh_search_terms(changed, adding)
+
+    def refresh_search_terms(self, names, adding=False):
+        # replace the old ones at once, so that a concurrent search finds either those or the new ones
+        with transaction.atomic(using=self._state.db):
+            if not adding:
+                UserSearchTerm.objects.filter(user=self, field__in=names).delete()
+            UserSearchTerm.objects.bulk_create([
+                UserSearchTerm(user=self, field=name, digest=value)
+                for name in names for value in blind_index.prefix_indexes(name, getattr(self, name))
+            ])
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        # when any of the deferred encrypted fields is accessed, load (and decrypt) all of them at once
+        if fields is not None and set(fields) & set(ENCRYPTED_FIELDS):
+            fields = {*fields, *(set(ENCRYPTED_FIELDS) & self.get_deferred_fields())}
+        elif fields is None:
+            # the base manager defers the encrypted fields, so reload the loaded ones explicitly
+            deferred = self.get_deferred_fields()
+            fields = [f.attname for f in self._meta.concrete_fields if f.attname not in deferred]
+        super().refresh_from_db(using, fields, **kwargs)
+
+
+class UserSearchTerm(models.Model):
+    # blind index of a prefix of an encrypted field of a User (see blind_index.py)
+    user = models.ForeignKey(User, related_name='search_terms', on_delete=models.CASCADE)
+    field = models.CharField(max_length=20)
+    digest = models.CharField(max_length=64, db_index=True)
@@ -7,7 +7,10 @@ from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 from django.utils.safestring import mark_safe
 from rules.contrib.admin import ObjectPermissionsModelAdmin
+from custom_user.blind_index import search_q
+from custom_user.models import ENCRYPTED_FIELDS
 from .models import Campaign, School, Survey
+from .changes import delete_with_tombstones
 
 
 #################################################
@@ -33,6 +36,10 @@ def field_link(obj, field=None, target=None, textfield=None, want_no_link=False)
 class BaseAdmin(ObjectPermissionsModelAdmin):
     save_on_top = True
 
+    def delete_queryset(self, request, queryset):
+        # the "delete selected" action, with one insert for all the Tombstones
+        delete_with_tombstones(queryset)
+
 
 class CampaignInline(admin.TabularInline):
     model = Campaign.schools.through
@@ -77,11 +84,22 @@ class SurveyAdmin(BaseAdmin):
     list_display = ("__str__", 'status', 'stamp')
     search_fields = ("campaign__name", "campaign__uuid",
                      "school__name", "school__uuid",
-                     "user__username", "user__email", 
-                     "user__first_name", "user__last_name",
+                     "user__username",
                      )
     list_filter = ('status', 'kind', )
     readonly_fields = ('stamp', )
 
+    def get_queryset(self, request):
+        # __str__() shows the User (only its username), the Campaign and the School
+        return super().get_queryset(request).select_related('user', 'campaign', 'school') \
+            .defer(*['user__' + name for name in ENCRYPTED_FIELDS])
+
+    def get_search_results(self, request, queryset, search_term):
+        # encrypted fields of the User are searched by their blind indexes
+        res, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            res |= queryset.filter(search_q(ENCRYPTED_FIELDS, search_term, prefix='user__'))
+        return res, may_have_duplicates
+
 
 admin.site.register(Survey, SurveyAdmin)
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class MosurvConfig(AppConfig):
     name = "mosurv"
+
+    def ready(self):
+        from . import signals  # noqa: F401
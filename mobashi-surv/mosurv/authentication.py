@@ -0,0 +1,78 @@
+# Django Rest Framework authentication
+import time
+from django.contrib.auth import get_user_model
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from pgcrypto.mixins import PGPMixin
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from .caching import get_cache
+from .metrics import metrics
+
+# "token:<key>" is the pk of the User of the Token, "user:<pk>" the values of the fields of the User
+# (invalidated, see signals.py, when a Token is deleted, ie: on logout, or a User is saved or deleted;
+# but not by QuerySet.update(), so call invalidate_user() after updating Users that way)
+auth_cache = get_cache('auth_tokens', maxsize=10000, ttl=300)
+# a local cache is only invalidated in its own process, so the other ones keep authenticating
+# a deleted Token or a deactivated User until it expires: only for a few seconds, unless shared
+LOCAL_TTL = 5
+cache_ttl = None if auth_cache.shared else LOCAL_TTL
+
+
+def get_user_fields(model):
+    # all the concrete fields, except the password and the encrypted ones
+    # (decrypted by the database, so only loaded if really needed)
+    return [f.attname for f in model._meta.concrete_fields
+            if f.attname != 'password' and not isinstance(f, PGPMixin)]
+
+
+def invalidate_token(key):
+    auth_cache.delete(f'token:{key}')
+
+
+def invalidate_user(user_pk):
+    auth_cache.delete(f'user:{user_pk}')
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Same as TokenAuthentication, but caching the Token and (a snapshot of) its User,
+    so that usually no query is needed at all.
+    The User is rebuilt from the cached values of its fields, the other ones are deferred.
+    """
+
+    def authenticate_credentials(self, key):
+        start = time.perf_counter()
+        try:
+            return self.get_credentials(key)
+        finally:
+            metrics.incr('auth.token.requests')
+            metrics.incr('auth.token.seconds', time.perf_counter() - start)
+
+    def get_credentials(self, key):
+        model = self.get_model()
+        User = get_user_model()
+        fields = get_user_fields(User)
+
+        user_pk = auth_cache.get(f'token:{key}')
+        values = None if user_pk is None else auth_cache.get(f'user:{user_pk}')
+        if values is None:
+            metrics.incr('auth.token.misses')
+            try:
+                token = model.objects.select_related('user') \
+                    .only('key', 'user', *['user__' + name for name in fields]).get(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            user_pk = token.user_id
+            values = [getattr(token.user, name) for name in fields]
+            auth_cache.set(f'token:{key}', user_pk, ttl=cache_ttl)
+            auth_cache.set(f'user:{user_pk}', values, ttl=cache_ttl)
+        else:
+            metrics.incr('auth.token.hits')
+
+        user = User.from_db(router.db_for_read(User), fields, values)
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        token = model.from_db(router.db_for_read(model), ['key', 'user_id'], [key, user_pk])
+        token.user = user
+        return (user, token)
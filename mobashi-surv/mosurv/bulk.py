@@ -0,0 +1,138 @@
+# Bulk operations, used by the MAIN server to push many objects at once
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from .models import Campaign, School, Cascho
+from .enrollment import invalidate_codes
+from .changes import delete_with_tombstones
+
+# the whole School is replaced, so missing optional fields are set to null
+SCHOOL_FIELDS = ['name', 'code', 'address', 'lat', 'lng']
+
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def upsert_schools(rows, chunk_size=1000):
+    """
+    Insert or update (by "uuid") the Schools specified by "rows" (dicts with the same fields
+    as SchoolSerializer) with one INSERT ... ON CONFLICT DO UPDATE for each chunk, and return
+    the number of "inserted" and "updated" ones, and the "rejected" ones (with the reason).
+    """
+    res = {'inserted': 0, 'updated': 0, 'rejected': []}
+
+    def reject(index, row, errors):
+        res['rejected'].append({
+            'index': index,
+            'uuid': row.get('uuid') if isinstance(row, dict) else None,
+            'errors': errors,
+        })
+
+    # validate all the rows in memory (unique checks are done by chunk)
+    valid = []
+    seen_uuids, seen_names = set(), set()
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            reject(index, row, {'non_field_errors': ['Not an object']})
+            continue
+        if not row.get('uuid'):
+            reject(index, row, {'uuid': ['This field is required.']})
+            continue
+        # empty values are null (clean_fields() would not convert them)
+        obj = School(uuid=row['uuid'], **{name: None if row.get(name) == '' else row.get(name)
+                                          for name in SCHOOL_FIELDS})
+        try:
+            obj.clean_fields()
+        except ValidationError as exc:
+            reject(index, row, exc.message_dict)
+            continue
+        if obj.uuid in seen_uuids or obj.name in seen_names:
+            reject(index, row, {'non_field_errors': ['Duplicated uuid or name']})
+            continue
+        seen_uuids.add(obj.uuid)
+        seen_names.add(obj.name)
+        valid.append((index, row, obj))
+
+    for chunk in chunked(valid, chunk_size):
+        existing = dict(School.objects.filter(
+            Q(uuid__in=[obj.uuid for _, _, obj in chunk]) | Q(name__in=[obj.name for _, _, obj in chunk])
+        ).values_list('name', 'uuid'))
+        uuids = set(existing.values())
+        objs = []
+        for index, row, obj in chunk:
+            if existing.get(obj.name, obj.uuid) != obj.uuid:
+                reject(index, row, {'name': ['School with this name already exists.']})
+                continue
+            objs.append((index, row, obj))
+        try:
+            with transaction.atomic():
+                upsert(objs)
+        except IntegrityError:
+            # ie: a School concurrently created with the same name, so retry one by one to find the culprits
+            for index, row, obj in list(objs):
+                try:
+                    with transaction.atomic():
+                        upsert([(index, row, obj)])
+                except IntegrityError as exc:
+                    objs.remove((index, row, obj))
+                    reject(index, row, {'non_field_errors': [str(exc)]})
+        updated = sum(1 for _, _, obj in objs if obj.uuid in uuids)
+        res['updated'] += updated
+        res['inserted'] += len(objs) - updated
+    return res
+
+
+def upsert(objs):
+    School.objects.bulk_create(
+        [obj for _, _, obj in objs],
+        update_conflicts=True, unique_fields=['uuid'], update_fields=[*SCHOOL_FIELDS, 'updated_at'])
+
+
+def resolve_schools(school_uuids):
+    # return the ids of the Schools by uuid (only of the existing ones), with one query
+    return dict(School.objects.filter(uuid__in=set(school_uuids)).values_list('uuid', 'id'))
+
+
+def link_schools(campaign, school_uuids):
+    """
+    Add the Schools specified by "school_uuids" to the Campaign, with one bulk insert,
+    and return the uuids of the "added" ones, of the "unchanged" ones (already part of it)
+    and of the "missing" ones (that do not exist).
+    """
+    schools = resolve_schools(school_uuids)
+    with transaction.atomic():
+        # lock the Campaign, so that concurrent calls do not both link the same Schools
+        # (there is no unique constraint on the links)
+        Campaign.objects.select_for_update().filter(pk=campaign.pk).values_list('pk').first()
+        linked = set(Cascho.objects.filter(campaign=campaign, school_id__in=schools.values())
+                     .values_list('school_id', flat=True))
+        added = [uuid for uuid, school_id in schools.items() if school_id not in linked]
+        Cascho.objects.bulk_create([Cascho(campaign=campaign, school_id=schools[uuid]) for uuid in added])
+    if added:
+        # bulk_create() does not send post_save signals (see signals.py)
+        invalidate_codes()
+    return {
+        'added': added,
+        'unchanged': [uuid for uuid, school_id in schools.items() if school_id in linked],
+        'missing': [uuid for uuid in dict.fromkeys(school_uuids) if uuid not in schools],
+    }
+
+
+def unlink_schools(campaign, school_uuids):
+    """
+    Remove the Schools specified by "school_uuids" from the Campaign, with one set-based delete,
+    and return the uuids of the "removed" ones, of the "unchanged" ones (not part of it)
+    and of the "missing" ones (that do not exist).
+    """
+    schools = resolve_schools(school_uuids)
+    with transaction.atomic():
+        queryset = Cascho.objects.filter(campaign=campaign, school_id__in=schools.values())
+        linked = set(queryset.values_list('school_id', flat=True))
+        delete_with_tombstones(queryset)
+    return {
+        'removed': [uuid for uuid, school_id in schools.items() if school_id in linked],
+        'unchanged': [uuid for uuid, school_id in schools.items() if school_id not in linked],
+        'missing': [uuid for uuid in dict.fromkeys(school_uuids) if uuid not in schools],
+    }
@@ -0,0 +1,120 @@
+# Caches local to the process (ie: the gunicorn worker), or shared by all the processes
+import threading
+import time
+from collections import OrderedDict
+from uuid import uuid4
+from django.conf import settings
+from django.core.cache import caches
+from .metrics import metrics
+
+MISSING = object()
+
+
+class LocalCache:
+    """
+    Thread-safe in-process cache, whose entries expire after "ttl" seconds,
+    evicting the least recently used ones when more than "maxsize".
+    """
+    shared = False
+
+    def __init__(self, name, maxsize=1024, ttl=60):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._data = OrderedDict()
+        metrics.gauge(f'cache.{name}.size', self.__len__)
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, MISSING)
+            if item is not MISSING:
+                expires, value = item
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    metrics.incr(f'cache.{self.name}.hits')
+                    return value
+                del self._data[key]
+        metrics.incr(f'cache.{self.name}.misses')
+        return default
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                metrics.incr(f'cache.{self.name}.evictions')
+
+    def add(self, key, value, ttl=None):
+        # set the value only if the key is not already there, returning whether it was set
+        with self._lock:
+            item = self._data.get(key, MISSING)
+            if item is not MISSING and item[0] > time.monotonic():
+                return False
+            self.set(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SharedCache:
+    """
+    Same as LocalCache, but on top of one of the Django CACHES (ie: Redis or Memcached),
+    so that it is shared by all the processes. Eviction is left to the cache itself.
+    """
+    shared = True
+
+    def __init__(self, name, alias='default', ttl=60):
+        self.name = name
+        self.ttl = ttl
+        self.cache = caches[alias]
+        # changed by clear(), to invalidate all the keys at once
+        self._generation_key = f'mosurv:{name}:generation'
+
+    def _key(self, key):
+        generation = self.cache.get_or_set(self._generation_key, uuid4().hex, timeout=None)
+        return f'mosurv:{self.name}:{generation}:{key}'
+
+    def get(self, key, default=None):
+        value = self.cache.get(self._key(key), MISSING)
+        if value is MISSING:
+            metrics.incr(f'cache.{self.name}.misses')
+            return default
+        metrics.incr(f'cache.{self.name}.hits')
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.cache.set(self._key(key), value, timeout=self.ttl if ttl is None else ttl)
+
+    def add(self, key, value, ttl=None):
+        return self.cache.add(self._key(key), value, timeout=self.ttl if ttl is None else ttl)
+
+    def delete(self, key):
+        self.cache.delete(self._key(key))
+
+    def clear(self):
+        self.cache.set(self._generation_key, uuid4().hex, timeout=None)
+
+
+def get_cache(name, maxsize=1024, ttl=60):
+    """
+    Return a LocalCache, unless MOSURV_CACHES[name]["BACKEND"] is "shared".
+    Default "maxsize" and "ttl" are overridden by "MAXSIZE" and "TTL" in MOSURV_CACHES[name],
+    and "ALIAS" is the Django cache used by a shared cache.
+    """
+    config = getattr(settings, 'MOSURV_CACHES', {}).get(name, {})
+    ttl = config.get('TTL', ttl)
+    if config.get('BACKEND', 'local') == 'shared':
+        return SharedCache(name, alias=config.get('ALIAS', 'default'), ttl=ttl)
+    return LocalCache(name, maxsize=config.get('MAXSIZE', maxsize), ttl=ttl)
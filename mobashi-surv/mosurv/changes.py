@@ -0,0 +1,125 @@
+# Feed of the changes of Schools, Campaigns and links between them (see ChangesView),
+# so that the MAIN server can sync incrementally instead of comparing whole tables
+from collections import namedtuple
+from contextvars import ContextVar
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import Campaign, School, Cascho, Tombstone
+from .pagination import get_horizon
+from .serializers import SchoolSerializer, CampaignSerializer, ChangeCaschoSerializer
+
+# how long Tombstones are kept (see the "prune_tombstones" command)
+TOMBSTONES_DAYS = 90
+
+# the rank of a source breaks ties among items of different sources with the same stamp
+Source = namedtuple('Source', ['rank', 'type', 'field', 'get_queryset', 'serializer_class'])
+
+SOURCES = [
+    Source(0, 'school', 'updated_at', lambda: School.objects.all(), SchoolSerializer),
+    Source(1, 'campaign', 'updated_at', lambda: Campaign.objects.prefetch_related('schools'),
+           CampaignSerializer),
+    Source(2, 'cascho', 'updated_at', lambda: Cascho.objects.select_related('campaign', 'school')
+           .only('id', 'updated_at', 'campaign__uuid', 'school__uuid'), ChangeCaschoSerializer),
+    Source(3, 'tombstone', 'deleted_at', lambda: Tombstone.objects.all(), None),
+]
+
+
+def after_change(queryset, source, stamp, rank, pk):
+    # keyset condition equivalent to "(<field>, <rank of source>, id) > (%s, %s, %s)"
+    field = source.field
+    if source.rank > rank:
+        return queryset.filter(**{f'{field}__gte': stamp})
+    if source.rank < rank:
+        return queryset.filter(**{f'{field}__gt': stamp})
+    return queryset.filter(Q(**{f'{field}__gt': stamp}) | Q(**{field: stamp, 'id__gt': pk}))
+
+
+def get_changes(position=None, limit=1000):
+    """
+    Return at most "limit" changes after "position" (a tuple of stamp, rank and id),
+    ordered by position, each as a tuple of its position and the changed (or deleted) object.
+    The most recent ones are left to the next call (see pagination.get_horizon()).
+    """
+    horizon = get_horizon()
+    res = []
+    for source in SOURCES:
+        queryset = source.get_queryset().filter(**{f'{source.field}__lte': horizon})
+        if position is not None:
+            queryset = after_change(queryset, source, *position)
+        queryset = queryset.order_by(source.field, 'id')[:limit]
+        res.extend(((getattr(obj, source.field), source.rank, obj.pk), obj) for obj in queryset)
+    res.sort(key=lambda x: x[0])
+    return res[:limit]
+
+
+def serialize_changes(changes, context=None):
+    # group by source, to serialize all the objects of each source at once
+    objs = {}
+    for (_, rank, _), obj in changes:
+        objs.setdefault(rank, []).append(obj)
+    data = {}
+    for source in SOURCES:
+        if source.serializer_class is not None and source.rank in objs:
+            items = source.serializer_class(objs[source.rank], many=True, context=context).data
+            data.update(((source.rank, obj.pk), item) for obj, item in zip(objs[source.rank], items))
+
+    res = []
+    for (stamp, rank, pk), obj in changes:
+        if isinstance(obj, Tombstone):
+            res.append({'type': obj.model, 'op': 'delete', 'id': obj.object_id, 'uuid': obj.uuid,
+                        'stamp': stamp, 'data': None})
+        else:
+            res.append({'type': SOURCES[rank].type, 'op': 'upsert', 'id': pk, 'uuid': getattr(obj, 'uuid', None),
+                        'stamp': stamp, 'data': data[(rank, pk)]})
+    return res
+
+
+# model whose objects are being deleted by delete_with_tombstones(), already recorded
+bulk_recorded = ContextVar('bulk_recorded', default=None)
+
+
+def delete_with_tombstones(queryset):
+    """
+    Delete the objects of "queryset" (as queryset.delete() does, returning the same),
+    recording their Tombstones with a single insert, instead of one for each of them
+    as the post_delete receiver does (see signals.create_tombstone()).
+    """
+    model = queryset.model
+    if model not in [School, Campaign, Cascho]:
+        return queryset.delete()
+    with transaction.atomic():
+        # links have no uuid
+        uuids = dict(queryset.values_list('pk', 'uuid')) if model is not Cascho \
+            else dict.fromkeys(queryset.values_list('pk', flat=True))
+        Tombstone.objects.bulk_create([
+            Tombstone(model=model._meta.model_name, object_id=pk, uuid=uuid) for pk, uuid in uuids.items()
+        ])
+        token = bulk_recorded.set(model)
+        try:
+            # only those recorded, not any created in the meantime
+            return model.objects.filter(pk__in=uuids).delete()
+        finally:
+            bulk_recorded.reset(token)
+
+
+def tombstones_horizon():
+    # Tombstones older than this may have been pruned, so changes before it are not complete
+    days = getattr(settings, 'MOSURV_TOMBSTONES_DAYS', TOMBSTONES_DAYS)
+    return timezone.now() - timedelta(days=days)
+
+
+def prune_tombstones(before, chunk_size=10000):
+    """
+    Delete the Tombstones older than "before", a chunk at a time (not to lock
+    the table for long), and return how many were deleted.
+    """
+    res = 0
+    while True:
+        ids = list(Tombstone.objects.filter(deleted_at__lt=before)
+                   .order_by('deleted_at').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return res
+        res += Tombstone.objects.filter(id__in=ids).delete()[0]
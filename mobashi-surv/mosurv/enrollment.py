@@ -0,0 +1,36 @@
+# Resolution of the codes scanned by the Clients to enroll into a Campaign for a School
+from collections import namedtuple
+from uuid import UUID
+from .caching import get_cache
+from .models import Cascho
+
+EnrollmentCode = namedtuple(
+    'EnrollmentCode', ['campaign_id', 'school_id', 'stamp_start', 'stamp_end'])
+
+# invalidated (see signals.py) whenever any Campaign, School or link between them changes
+codes_cache = get_cache('enrollment_codes', maxsize=1024, ttl=300)
+
+
+def resolve_code(campaign_uuid, school_uuid):
+    """
+    Return the EnrollmentCode for the specified Campaign and School,
+    or None if they do not exist or the School is not part of the Campaign.
+    Raise ValueError if any of the uuids is not valid.
+    """
+    campaign_uuid, school_uuid = UUID(campaign_uuid), UUID(school_uuid)
+    key = f'{campaign_uuid}@{school_uuid}'
+    res = codes_cache.get(key)
+    if res is None:
+        # a single (indexed) probe of the link between Campaign and School
+        row = Cascho.objects.filter(campaign__uuid=campaign_uuid, school__uuid=school_uuid) \
+            .values_list('campaign_id', 'school_id', 'campaign__stamp_start', 'campaign__stamp_end') \
+            .first()
+        if row is None:
+            return None
+        res = EnrollmentCode(*row)
+        codes_cache.set(key, res)
+    return res
+
+
+def invalidate_codes():
+    codes_cache.clear()
@@ -0,0 +1,47 @@
+# Django Rest Framework filters
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+from .pagination import decode_position, after_position, before_horizon
+
+
+def parse_since(value, lowest=(0,), name='since'):
+    """
+    Return the position (a tuple of stamp and keys) specified by "value", either a watermark
+    as returned by KeysetPagination (with as many keys as "lowest") or a plain ISO 8601 timestamp,
+    that is before any item with that stamp (ie: with the "lowest" keys).
+    Raise ValidationError (for the "name" parameter) if it is neither.
+    """
+    try:
+        return decode_position(value, keys=len(lowest))
+    except (TypeError, ValueError):
+        pass
+    try:
+        stamp = parse_datetime(value)
+    except ValueError:
+        stamp = None
+    if stamp is None:
+        raise ValidationError({name: _('Invalid watermark')})
+    # in the current time zone if not specified, as the database would do anyway
+    if timezone.is_naive(stamp):
+        stamp = timezone.make_aware(stamp)
+    return (stamp, *lowest)
+
+
+class SinceFilter(BaseFilterBackend):
+    """
+    Only keep items created or changed after the specified watermark,
+    either as returned by KeysetPagination or as a plain ISO 8601 timestamp,
+    and not in the last MOSURV_HARVEST_LAG seconds (see get_horizon()).
+    """
+    since_query_param = 'since'
+
+    def filter_queryset(self, request, queryset, view):
+        since = request.query_params.get(self.since_query_param)
+        if not since:
+            return queryset
+        stamp, pk = parse_since(since, name=self.since_query_param)
+        # as KeysetPagination does, also when not paginated (ie: streamed)
+        return before_horizon(after_position(queryset, stamp, pk))
@@ -0,0 +1,86 @@
+# Replay of the responses to requests retried with the same "Idempotency-Key" header.
+# Retries may reach any process (ie: gunicorn worker), so with more than one of them the "idempotency"
+# cache MUST be shared (see MOSURV_CACHES), otherwise most retries are not recognized as such.
+from rest_framework import status
+from rest_framework.response import Response
+from .caching import get_cache
+from .models import json_hash
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+# keys of anonymous requests must be long enough not to be guessed (ie: a random UUID)
+MIN_ANONYMOUS_KEY_LENGTH = 32
+# how long a request being handled blocks others with the same key
+IN_PROGRESS_TTL = 60
+
+# expired entries are evicted automatically
+responses_cache = get_cache('idempotency', maxsize=10000, ttl=24 * 3600)
+
+
+def get_cache_key(request, fingerprint):
+    key = request.META.get(IDEMPOTENCY_HEADER, '').strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        return None
+    user = request.user
+    if user.is_authenticated:
+        # keys are generated by the Clients, so do not mix those of different Users
+        return f'{user.pk}:{key}'
+    # anonymous requests are only told apart by the key, that must be hard to guess,
+    # and only the very same request is replayed (nor is the key itself stored)
+    if len(key) < MIN_ANONYMOUS_KEY_LENGTH:
+        return None
+    return f':{json_hash([key, fingerprint])}'
+
+
+def begin(request, payload):
+    """
+    Return the Response to send back if the request was already handled (or is being handled)
+    with the same Idempotency-Key, otherwise mark it as being handled and return None.
+    "payload" identifies the request, so that a key cannot be reused for a different one.
+    A replayed Response has the pk of the User stored with it as "idempotent_user_pk".
+    """
+    fingerprint = json_hash(payload)
+    key = get_cache_key(request, fingerprint)
+    if key is None:
+        return None
+    if responses_cache.add(key, {'fingerprint': fingerprint}, ttl=IN_PROGRESS_TTL):
+        return None
+    entry = responses_cache.get(key)
+    if entry is None:  # just expired
+        return None
+    if entry['fingerprint'] != fingerprint:
+        return Response({
+            'error': 'IDEMPOTENCY_KEY_REUSED',
+            'message': 'Idempotency-Key already used for a different request'
+        }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    if 'status' not in entry:
+        return Response({
+            'error': 'IDEMPOTENCY_IN_PROGRESS',
+            'message': 'A request with the same Idempotency-Key is being handled'
+        }, status=status.HTTP_409_CONFLICT)
+    response = Response(entry['data'], status=entry['status'], headers={'Idempotent-Replayed': 'true'})
+    response.idempotent_user_pk = entry.get('user')
+    return response
+
+
+def finish(request, payload, response, secrets=(), user=None):
+    """
+    Store the Response to the request, to be replayed for any retry with the same Idempotency-Key,
+    unless it is an error (or None, if an exception was raised), so that the request can be retried.
+    The "secrets" items of the data (ie: auth tokens) are not stored, the caller must add them back
+    to the replayed Response, ie: from the "user" stored with it (see begin()).
+    """
+    fingerprint = json_hash(payload)
+    key = get_cache_key(request, fingerprint)
+    if key is None:
+        return
+    if response is None or response.status_code >= 400:
+        responses_cache.delete(key)
+        return
+    responses_cache.set(key, {
+        'fingerprint': fingerprint,
+        'status': response.status_code,
+        'data': {name: value for name, value in response.data.items() if name not in secrets}
+        if secrets else response.data,
+        'user': None if user is None else user.pk,
+    })
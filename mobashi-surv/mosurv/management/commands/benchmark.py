@@ -0,0 +1,185 @@
+import random
+import time
+from datetime import datetime, timedelta
+from dateutil import tz
+from dateutil.parser import parse
+from dateutil.utils import default_tzinfo
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework import serializers
+from mosurv.models import Campaign, School, Survey
+from mosurv.serializers import SurveySerializer
+from mosurv.stages import build_stages, build_stages_many
+
+GEO = {'name': 'School', 'address': 'Address', 'lat': 45.46, 'lng': 9.19}
+STAMP_FORMATS = [
+    lambda dt: dt.isoformat(),
+    lambda dt: dt.strftime('%Y-%m-%dT%H:%M:%S'),
+    lambda dt: dt.strftime('%Y-%m-%d %H:%M'),
+    lambda dt: dt.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+    lambda dt: dt.strftime('%d/%m/%Y %H:%M'),  # not ISO, handled by dateutil
+]
+
+
+def legacy_build_stages(content, def_geo):
+    # TripSerializer.get_stages() as it was before stages.py, for comparison
+    res = []
+    if type(content) is dict:
+        tzone = tz.gettz(content.get('TZ'))
+        orig = content.get('orig') or def_geo or None
+        orig_stamp = content.get('orig_stamp') or None
+        for stage in content.get('stages', []):
+            if not orig or not orig_stamp:
+                continue
+            if not type(stage) is dict:
+                continue
+            stage = dict(stage)
+            stage.setdefault('orig', orig)
+            stage.setdefault('orig_stamp', orig_stamp)
+            stage.setdefault('dest', def_geo)
+            orig = stage.get('dest') or None
+            orig_stamp = stage.get('dest_stamp') or None
+            stage['orig_stamp'] = default_tzinfo(
+                parse(stage['orig_stamp']), tzone).isoformat()
+            stage['dest_stamp'] = default_tzinfo(
+                parse(stage['dest_stamp']), tzone).isoformat()
+            res.append(stage)
+    return res
+
+
+class LegacyCampaignSerializer(serializers.ModelSerializer):
+    # CampaignSerializer as it was before campaign_status(), for comparison
+    status = serializers.ReadOnlyField()
+    is_active = serializers.ReadOnlyField()
+
+    class Meta:
+        model = Campaign
+        fields = '__all__'
+
+
+class LegacySchoolSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = School
+        fields = '__all__'
+
+
+class LegacyGeoSchoolSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = School
+        fields = School.GEO_FIELDS
+
+
+class LegacySurveySerializer(SurveySerializer):
+    # SurveySerializer as it was before campaign_status() and SharedRepresentationMixin, for comparison
+    campaign = LegacyCampaignSerializer(many=False, read_only=True)
+    school = LegacySchoolSerializer(many=False, read_only=True)
+    def_orig = LegacyGeoSchoolSerializer(source='school', many=False, read_only=True)
+    def_dest = LegacyGeoSchoolSerializer(source='school', many=False, read_only=True)
+
+    def get_status(self, obj):
+        return obj.Status.CANCELLED if obj.status in [obj.Status.EMPTY, obj.Status.FILLED] and not obj.campaign.is_active else obj.status
+
+    def get_must_fillout(self, obj):
+        return obj.status == obj.Status.EMPTY and obj.campaign.is_active
+
+    def get_can_edit(self, obj):
+        return obj.status in [obj.Status.EMPTY, obj.Status.FILLED] and obj.campaign.is_active
+
+
+def prefetched(queryset, objs):
+    # a queryset already evaluated, as prefetch_related() leaves it (so that no query is done)
+    queryset._result_cache = list(objs)
+    queryset._prefetch_done = True
+    return queryset
+
+
+class Command(BaseCommand):
+    help = "Run micro-benchmarks of hot code paths on synthetic data (no database needed)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('target', choices=['stamps', 'survey_list'],
+                            help='What to benchmark')
+        parser.add_argument('--count', type=int, default=10000,
+                            help='Number of synthetic items')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        getattr(self, 'bench_' + options['target'])(options['count'])
+
+    def timeit(self, label, func, *args):
+        start = time.perf_counter()
+        res = func(*args)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'{label:<30} {elapsed * 1000:10.1f} ms')
+        return res, elapsed
+
+    def synthetic_trip(self, formats):
+        stamp = datetime(2024, 4, 1, 7, 0) + timedelta(days=random.randrange(60),
+                                                       minutes=5 * random.randrange(24))
+        fmt = random.choice(formats)
+        stages = []
+        for i in range(random.randint(1, 5)):
+            stamp += timedelta(minutes=random.randint(1, 30))
+            stages.append({
+                'dest': {'lat': 45 + random.random(), 'lng': 9 + random.random()},
+                'dest_stamp': fmt(stamp),
+                'mode': random.choice(['walk', 'bike', 'bus', 'car']),
+            })
+        return {
+            'TZ': random.choice(['Europe/Rome', 'Europe/Rome', 'UTC']),
+            'orig_stamp': fmt(stamp - timedelta(minutes=10)),
+            'stages': stages,
+        }
+
+    def bench_stamps(self, count):
+        for label, formats in [('ISO 8601 stamps', STAMP_FORMATS[:4]),
+                               ('any stamps', STAMP_FORMATS)]:
+            contents = [self.synthetic_trip(formats) for _ in range(count)]
+            self.stdout.write(f'{count} trips with {label}:')
+            legacy, legacy_elapsed = self.timeit(
+                'legacy (dateutil)', lambda: [legacy_build_stages(c, GEO) for c in contents])
+            single, single_elapsed = self.timeit(
+                'build_stages()', lambda: [build_stages(c, GEO) for c in contents])
+            batch, batch_elapsed = self.timeit(
+                'build_stages_many()', lambda: build_stages_many((c, GEO) for c in contents))
+            if not legacy == single == batch:
+                self.stderr.write(self.style.ERROR('Results differ from legacy ones!'))
+            self.stdout.write(f'speedup: {legacy_elapsed / single_elapsed:.1f}x single, '
+                              f'{legacy_elapsed / batch_elapsed:.1f}x batch')
+
+    def synthetic_surveys(self, count):
+        # Surveys (never saved) of a few Campaigns, some of them no more active
+        now = timezone.now()
+        schools = [School(id=i, name=f'School {i}', **{k: v for k, v in GEO.items() if k != 'name'})
+                   for i in range(1, 51)]
+        campaigns = []
+        for i in range(1, 21):
+            start = now + timedelta(days=random.randint(-60, 10))
+            campaign = Campaign(id=i, name=f'Campaign {i}', stamp_start=start,
+                                stamp_end=start + timedelta(days=30))
+            campaign._prefetched_objects_cache = {
+                'schools': prefetched(School.objects.all(), random.sample(schools, 10))}
+            campaigns.append(campaign)
+        surveys = []
+        for i in range(1, count + 1):
+            campaign = random.choice(campaigns)
+            school = random.choice(campaign.schools.all())
+            surveys.append(Survey(
+                id=i, kind=random.choice(['forth', 'back']), user_id=i, campaign=campaign, school=school,
+                status=random.choice(list(Survey.Status)), stamp=now,
+                content=self.synthetic_trip(STAMP_FORMATS[:1])))
+        return surveys
+
+    def bench_survey_list(self, count):
+        # as SurveyViewSet.list() does, Campaigns and Schools are shared by many Surveys
+        surveys = self.synthetic_surveys(count)
+        self.stdout.write(f'{count} Surveys of 20 Campaigns:')
+        legacy, legacy_elapsed = self.timeit(
+            'legacy', lambda: LegacySurveySerializer(surveys, many=True).data)
+        memo, memo_elapsed = self.timeit(
+            'SurveySerializer', lambda: SurveySerializer(surveys, many=True).data)
+        # results may differ only if a Campaign started or ended while benchmarking
+        if legacy != memo:
+            self.stderr.write(self.style.ERROR('Results differ from legacy ones!'))
+        self.stdout.write(f'speedup: {legacy_elapsed / memo_elapsed:.1f}x')
@@ -0,0 +1,147 @@
+import csv
+import gzip
+import time
+from datetime import datetime, timezone
+from django.core.management.base import BaseCommand, CommandError
+from mosurv.models import School, Survey
+from mosurv.stages import build_stages, resolve_stages
+from mosurv.stamps import StampNormalizer
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+COLUMNS = [
+    'survey', 'campaign', 'school', 'kind', 'stage',
+    'orig_lat', 'orig_lng', 'dest_lat', 'dest_lng',
+    'orig_stamp', 'dest_stamp', 'mode',
+]
+
+
+def point(value, name):
+    return value.get(name) if type(value) is dict else None
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "Export the stages of the Surveys as a flat table (one row per stage) to a compressed CSV file, " \
+        "and optionally to a Parquet file (if pyarrow is installed)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='stages.csv.gz',
+                            help='Path of the gzip compressed CSV file')
+        parser.add_argument('--parquet',
+                            help='Path of the Parquet file (requires pyarrow)')
+        parser.add_argument('--campaign', action='append', default=[],
+                            help='UUID of the Campaign to export (may be repeated, default: all)')
+        parser.add_argument('--status', action='append', default=[],
+                            choices=[x.name for x in Survey.Status],
+                            help='Status of the Surveys to export (may be repeated, default: FILLED and USED)')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Number of Surveys fetched from the database at a time')
+
+    def handle(self, *args, **options):
+        if options['parquet'] and pyarrow is None:
+            raise CommandError('pyarrow is required to export to Parquet')
+
+        statuses = [Survey.Status[x] for x in options['status']] or [
+            Survey.Status.FILLED, Survey.Status.USED]
+        queryset = Survey.objects.filter(status__in=statuses)
+        if options['campaign']:
+            queryset = queryset.filter(campaign__uuid__in=options['campaign'])
+        queryset = queryset.select_related('campaign', 'school').only(
+            'id', 'kind', 'content', 'stages', 'campaign__uuid',
+            *['school__' + name for name in ['uuid', *School.GEO_FIELDS]]
+        ).order_by('id')
+
+        chunk_size = options['chunk_size']
+        parquet_writer = None
+        batch = []
+        surveys = rows = skipped = 0
+        start = time.perf_counter()
+        with gzip.open(options['output'], 'wt', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            for survey_rows in self.iter_rows(queryset.iterator(chunk_size=chunk_size), chunk_size):
+                if survey_rows is None:
+                    skipped += 1
+                    continue
+                surveys += 1
+                rows += len(survey_rows)
+                writer.writerows(survey_rows)
+                if options['parquet']:
+                    batch.extend(survey_rows)
+                    if len(batch) >= chunk_size:
+                        parquet_writer = self.write_parquet(
+                            parquet_writer, options['parquet'], batch)
+                        batch = []
+        if options['parquet']:
+            parquet_writer = self.write_parquet(parquet_writer, options['parquet'], batch)
+            parquet_writer.close()
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(f'Exported {rows} stages of {surveys} surveys '
+                          f'in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.0f} rows/s)')
+        if skipped:
+            self.stdout.write(self.style.WARNING(
+                f'Skipped {skipped} surveys whose stages cannot be normalized'))
+
+    def iter_rows(self, surveys, chunk_size):
+        # yield the rows (one for each stage) of each Survey, or None if its stages are not valid
+        school_geos = {}
+        for i, obj in enumerate(surveys):
+            if i % chunk_size == 0:
+                # a new normalizer for each chunk, as the same stamps are unlikely to be
+                # found far apart, so that memory does not grow during the whole export
+                normalizer = StampNormalizer()
+            def_geo = school_geos.get(obj.school_id)
+            if def_geo is None:
+                def_geo = school_geos[obj.school_id] = obj.school.geo
+            if obj.stages is not None:
+                stages = resolve_stages(obj.stages, def_geo)
+            else:
+                try:
+                    stages = build_stages(obj.content, def_geo, normalizer.normalize)
+                except (KeyError, TypeError, ValueError, OverflowError):
+                    yield None
+                    continue
+            yield [[
+                obj.id, obj.campaign.uuid, obj.school.uuid, obj.kind, index,
+                point(stage.get('orig'), 'lat'), point(stage.get('orig'), 'lng'),
+                point(stage.get('dest'), 'lat'), point(stage.get('dest'), 'lng'),
+                stage.get('orig_stamp'), stage.get('dest_stamp'), stage.get('mode'),
+            ] for index, stage in enumerate(stages)]
+
+    def write_parquet(self, writer, path, batch):
+        columns = list(zip(*batch)) if batch else [[] for _ in COLUMNS]
+        data = dict(zip(COLUMNS, columns))
+        for name in ['campaign', 'school']:
+            data[name] = [str(x) for x in data[name]]
+        for name in ['orig_stamp', 'dest_stamp']:
+            data[name] = [datetime.fromisoformat(x).astimezone(timezone.utc) if x else None
+                          for x in data[name]]
+        table = pyarrow.table({
+            'survey': pyarrow.array(data['survey'], pyarrow.int64()),
+            'campaign': pyarrow.array(data['campaign'], pyarrow.string()),
+            'school': pyarrow.array(data['school'], pyarrow.string()),
+            'kind': pyarrow.array(data['kind'], pyarrow.string()),
+            'stage': pyarrow.array(data['stage'], pyarrow.int32()),
+            **{name: pyarrow.array([to_float(x) for x in data[name]], pyarrow.float64())
+               for name in ['orig_lat', 'orig_lng', 'dest_lat', 'dest_lng']},
+            **{name: pyarrow.array(data[name], pyarrow.timestamp('us', tz='UTC'))
+               for name in ['orig_stamp', 'dest_stamp']},
+            'mode': pyarrow.array([None if x is None else str(x) for x in data['mode']],
+                                  pyarrow.string()),
+        })
+        if writer is None:
+            writer = pyarrow.parquet.ParquetWriter(path, table.schema, compression='zstd')
+        writer.write_table(table)
+        return writer
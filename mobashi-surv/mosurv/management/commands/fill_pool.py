@@ -0,0 +1,47 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q
+from django.utils import timezone
+from mosurv.models import Campaign
+from mosurv.pool import fill_pool, prune_pool
+
+
+class Command(BaseCommand):
+    help = "Create in advance the anonymous Users that enrollments into upcoming or active Campaigns " \
+        "will claim, so that they do not have to create them (run it periodically, ie: with cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--campaign', action='append', default=[],
+                            help='UUID of the Campaign (may be repeated, default: all upcoming or active ones)')
+        parser.add_argument('--size', type=int, default=500,
+                            help='Number of Users each pool must have')
+        parser.add_argument('--batch', type=int, default=200,
+                            help='Number of Users created in each transaction')
+        parser.add_argument('--status', action='store_true',
+                            help='Only show the depth of the pools')
+        parser.add_argument('--prune', action='store_true',
+                            help='Also delete the Users left in the pools of ended Campaigns')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        campaigns = Campaign.objects.exclude(stamp_start__isnull=True).exclude(stamp_end__isnull=True)
+        if options['campaign']:
+            campaigns = campaigns.filter(uuid__in=options['campaign'])
+        else:
+            campaigns = campaigns.filter(stamp_end__gt=now)
+        campaigns = campaigns.annotate(depth=Count('pooled_users'))
+
+        if options['prune']:
+            ended = Campaign.objects.filter(Q(stamp_end__lte=now) | Q(stamp_end__isnull=True))
+            count = prune_pool(ended)
+            self.stdout.write(f'Deleted {count} Users from the pools of ended Campaigns')
+
+        for campaign in campaigns:
+            if options['status']:
+                self.stdout.write(f'{campaign}: {campaign.depth} Users')
+                continue
+            start = time.perf_counter()
+            added = fill_pool(campaign, options['size'], batch=options['batch'])
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f'{campaign}: {campaign.depth + added} Users, {added} added '
+                              f'in {elapsed:.1f}s ({added / elapsed if elapsed else 0:.0f} Users/s)')
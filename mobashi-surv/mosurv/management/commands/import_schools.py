@@ -0,0 +1,57 @@
+import csv
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from mosurv.bulk import SCHOOL_FIELDS, upsert_schools
+
+
+def read_csv(path):
+    # empty cells are missing values (ie: null)
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return [{name: value for name, value in row.items() if value not in ('', None)}
+                for row in csv.DictReader(f)]
+
+
+def read_json(path):
+    # either a list of Schools or an object with such a list as "schools"
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get('schools')
+    if not isinstance(data, list):
+        raise CommandError('A list of schools is required')
+    return data
+
+
+class Command(BaseCommand):
+    help = "Insert or update (by \"uuid\") the Schools of a CSV or JSON file, " \
+        f"with columns/keys: uuid, {', '.join(SCHOOL_FIELDS)}"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path',
+                            help='Path of the CSV or JSON file')
+        parser.add_argument('--format', choices=['csv', 'json'],
+                            help='Format of the file (default: from its extension)')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of Schools written to the database at a time')
+        parser.add_argument('--show-rejected', type=int, default=10,
+                            help='Number of rejected Schools to show')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or ('json' if options['path'].lower().endswith('.json') else 'csv')
+        try:
+            rows = read_json(options['path']) if fmt == 'json' else read_csv(options['path'])
+        except (OSError, ValueError) as exc:
+            raise CommandError(f'Cannot read {options["path"]}: {exc}')
+
+        start = time.perf_counter()
+        res = upsert_schools(rows, chunk_size=options['chunk_size'])
+        elapsed = time.perf_counter() - start
+
+        rejected = res['rejected']
+        self.stdout.write(f'Read {len(rows)} schools: {res["inserted"]} inserted, {res["updated"]} updated, '
+                          f'{len(rejected)} rejected in {elapsed:.1f}s '
+                          f'({len(rows) / elapsed if elapsed else 0:.0f} rows/s)')
+        for item in rejected[:options['show_rejected']]:
+            self.stdout.write(self.style.WARNING(
+                f'  row {item["index"]} ({item["uuid"]}): {json.dumps(item["errors"])}'))
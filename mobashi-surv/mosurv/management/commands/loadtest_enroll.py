@@ -0,0 +1,170 @@
+import base64
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from uuid import uuid4
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from djoser.conf import settings as djoser_settings
+from mosurv.models import Campaign, School, Cascho
+
+ENROLL_PATH = '/surv/surveys/'
+UNIQUE_ERRORS = ['unique', 'duplicate key']
+
+
+def encode(value):
+    # base64url without padding, as SurveyViewSet.get_data() expects
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip('=')
+
+
+class Result:
+    def __init__(self, latency, status, body, queries=None):
+        self.latency = latency
+        self.status = status
+        self.body = body
+        self.queries = queries
+
+    @property
+    def is_unique_error(self):
+        return self.status != 200 and any(x in self.body.lower() for x in UNIQUE_ERRORS)
+
+    @property
+    def token(self):
+        try:
+            return json.loads(self.body).get('token')
+        except ValueError:
+            return None
+
+
+class Command(BaseCommand):
+    help = "Simulate whole Schools enrolling at the same moment, by sending concurrent requests " \
+        "with the codes of a synthetic Campaign, and report latency, throughput and errors"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schools', type=int, default=5,
+                            help='Number of synthetic Schools')
+        parser.add_argument('--students', type=int, default=100,
+                            help='Number of students enrolling for each School')
+        parser.add_argument('--retries', type=int, default=0,
+                            help='Number of concurrent retries of each enrollment, as flaky Clients do')
+        parser.add_argument('--concurrency', type=int, default=20,
+                            help='Number of concurrent threads sending requests')
+        parser.add_argument('--url',
+                            help='Base URL of a running server (ie: http://localhost:8000) using the same '
+                            'database, otherwise requests are handled in-process (and queries are counted)')
+        parser.add_argument('--keep', action='store_true',
+                            help='Do not delete the synthetic data at the end')
+
+    def handle(self, *args, **options):
+        self.url = options['url'] and options['url'].rstrip('/')
+        self.local = threading.local()
+        campaign, schools = self.create_data(options['schools'])
+        tokens = []
+        try:
+            codes = [encode(f'{campaign.uuid}@{school.uuid}') for school in schools]
+            requests = [{'code': code} for code in codes for _ in range(options['students'])]
+            results = self.run('Enrollment', requests, options['concurrency'])
+            tokens = [x.token for x in results if x.token]
+
+            if options['retries']:
+                # retries of the same User, sent at the same time
+                users = dict(djoser_settings.TOKEN_MODEL.objects.filter(key__in=tokens)
+                             .values_list('key', 'user__username'))
+                requests = [{'code': codes[i % len(codes)], 'username': encode(users[token])}
+                            for i, token in enumerate(tokens) for _ in range(options['retries'])]
+                self.run('Retries', requests, options['concurrency'])
+        finally:
+            if not options['keep']:
+                self.delete_data(campaign, schools, tokens)
+
+    def create_data(self, count):
+        now = timezone.now()
+        name = f'loadtest-{uuid4().hex[:8]}'
+        campaign = Campaign.objects.create(
+            name=name, stamp_start=now - timedelta(hours=1), stamp_end=now + timedelta(days=1))
+        schools = [School.objects.create(name=f'{name}-{i}') for i in range(count)]
+        Cascho.objects.bulk_create([Cascho(campaign=campaign, school=school) for school in schools])
+        self.stdout.write(f'Created Campaign "{name}" with {count} Schools')
+        return campaign, schools
+
+    def delete_data(self, campaign, schools, tokens):
+        users = get_user_model().objects.filter(auth_token__key__in=tokens)
+        count, _ = users.delete()
+        campaign.delete()
+        for school in schools:
+            school.delete()
+        self.stdout.write(f'Deleted synthetic data (and {count} objects of the enrolled Users)')
+
+    def run(self, label, requests, concurrency):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(self.send, requests))
+        elapsed = time.perf_counter() - start
+        self.report(label, results, elapsed)
+        return results
+
+    def send(self, data):
+        if self.url:
+            return self.send_http(data)
+        return self.send_local(data)
+
+    def send_http(self, data):
+        request = urllib.request.Request(
+            self.url + ENROLL_PATH, data=json.dumps(data).encode(),
+            headers={'Content-Type': 'application/json'}, method='POST')
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                status, body = response.status, response.read()
+        except urllib.error.HTTPError as exc:
+            status, body = exc.code, exc.read()
+        except OSError as exc:
+            status, body = 0, str(exc).encode()
+        return Result(time.perf_counter() - start, status, body.decode(errors='replace'))
+
+    def send_local(self, data):
+        # each thread has its own database connection, and so its own queries
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = Client(SERVER_NAME='localhost')
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            try:
+                response = client.post(ENROLL_PATH, data, content_type='application/json')
+                status, body = response.status_code, response.content.decode(errors='replace')
+            except Exception as exc:
+                status, body = 0, repr(exc)
+            latency = time.perf_counter() - start
+        return Result(latency, status, body, len(queries))
+
+    def report(self, label, results, elapsed):
+        latencies = sorted(x.latency * 1000 for x in results)
+        ok = sum(1 for x in results if x.status == 200)
+        unique_errors = sum(1 for x in results if x.is_unique_error)
+        self.stdout.write(f'{label}: {len(results)} requests in {elapsed:.2f}s '
+                          f'({len(results) / elapsed:.1f} req/s), {ok} OK, '
+                          f'{len(results) - ok} errors ({unique_errors} unique constraint errors)')
+        if len(latencies) > 1:
+            q = statistics.quantiles(latencies, n=100, method='inclusive')
+            self.stdout.write(f'  latency ms: p50 {q[49]:.1f}, p95 {q[94]:.1f}, p99 {q[98]:.1f}, '
+                              f'max {latencies[-1]:.1f}')
+        queries = [x.queries for x in results if x.queries is not None]
+        if queries:
+            self.stdout.write(f'  queries per request: mean {statistics.mean(queries):.1f}, '
+                              f'max {max(queries)}, total {sum(queries)}')
+        errors = {}
+        for x in results:
+            if x.status != 200:
+                errors.setdefault((x.status, x.body[:200]), 0)
+                errors[(x.status, x.body[:200])] += 1
+        for (status, body), count in sorted(errors.items(), key=lambda x: -x[1])[:5]:
+            self.stdout.write(self.style.WARNING(f'  {count} x {status}: {body}'))
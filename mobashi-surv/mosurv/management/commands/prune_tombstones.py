@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from mosurv.changes import prune_tombstones, tombstones_horizon
+
+
+class Command(BaseCommand):
+    help = "Delete the Tombstones older than MOSURV_TOMBSTONES_DAYS (run it periodically, ie: with cron). " \
+        "The changes feed answers \"410 Gone\" to watermarks older than that, " \
+        "so that the MAIN server syncs all again instead of missing deletions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                            help='Number of Tombstones deleted by each query')
+
+    def handle(self, *args, **options):
+        before = tombstones_horizon()
+        deleted = prune_tombstones(before, chunk_size=options['chunk_size'])
+        self.stdout.write(f'Deleted {deleted} tombstones older than {before.isoformat()}')
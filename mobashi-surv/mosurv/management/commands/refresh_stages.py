@@ -0,0 +1,56 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from mosurv.models import Survey
+
+
+class Command(BaseCommand):
+    help = "Compute the normalized stages of the Surveys that have none (ie: saved before they were " \
+        "stored, see migrations 0013 and 0019), so that harvesting them is a plain read"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--campaign', action='append', default=[],
+                            help='UUID of the Campaign (may be repeated, default: all)')
+        parser.add_argument('--all', action='store_true',
+                            help='Recompute the stages of all the Surveys, not only of those that have none')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of Surveys updated in each transaction')
+
+    def handle(self, *args, **options):
+        queryset = Survey.objects.exclude(content={})
+        if not options['all']:
+            queryset = queryset.filter(stages__isnull=True)
+        if options['campaign']:
+            queryset = queryset.filter(campaign__uuid__in=options['campaign'])
+        # the geo of the School is not needed, it is only filled in when harvested
+        queryset = queryset.only('id', 'content', 'stages').order_by('id')
+
+        chunk_size = options['chunk_size']
+        last_pk = 0
+        surveys = updated = 0
+        start = time.perf_counter()
+        while True:
+            # by keyset on "id", so that each chunk is a short transaction and the
+            # Surveys whose stages still cannot be normalized are not fetched again
+            with transaction.atomic():
+                chunk = list(queryset.filter(id__gt=last_pk).select_for_update(of=('self',))[:chunk_size])
+                if not chunk:
+                    break
+                last_pk = chunk[-1].pk
+                changed = []
+                for obj in chunk:
+                    stages = obj.stages
+                    obj.refresh_stages()
+                    if obj.stages != stages:
+                        changed.append(obj)
+                # bulk_update() does not touch "stamp", so the Surveys are not harvested again
+                Survey.objects.bulk_update(changed, ['stages'])
+            surveys += len(chunk)
+            updated += len(changed)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(f'Updated the stages of {updated} of {surveys} surveys '
+                          f'in {elapsed:.1f}s ({surveys / elapsed if elapsed else 0:.0f} surveys/s)')
+        if surveys > updated and not options['all']:
+            self.stdout.write(self.style.WARNING(
+                f'{surveys - updated} surveys still have stages that cannot be normalized'))
@@ -0,0 +1,32 @@
+# In-process metrics (so they are per gunicorn worker), exposed by MetricsView
+import threading
+from collections import defaultdict
+
+
+class Metrics:
+    """
+    Thread-safe named counters, plus gauges computed when read.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+        self._gauges = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def gauge(self, name, func):
+        # "func" is called (with no arguments) every time metrics are read
+        self._gauges[name] = func
+
+    def snapshot(self):
+        with self._lock:
+            res = dict(self._counters)
+        for name, func in self._gauges.items():
+            res[name] = func()
+        return dict(sorted(res.items()))
+
+
+metrics = Metrics()
@@ -0,0 +1,183 @@
+# Django middlewares
+import logging
+import re
+import time
+import zlib
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from .metrics import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_TYPES = ['application/json', 'application/x-ndjson']
+# responses carrying auth tokens (ie: the djoser login) are never compressed, see never_compress()
+EXEMPT_PATHS = [r'^/auth/token/']
+
+
+def strip_etag_coding(etag):
+    # the ETag of the uncompressed content (see CompressionMiddleware)
+    for coding in [GzipCompressor.encoding, BrotliCompressor.encoding]:
+        suffix = f'-{coding}"'
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)] + '"'
+    return etag
+
+
+def never_compress(response):
+    """
+    Exclude a response from compression, because it carries a secret (ie: an auth token)
+    that an attacker able to inject text in it and to observe its compressed size could
+    guess one character at a time (BREACH).
+    """
+    response.never_compress = True
+    return response
+
+
+def accepted_encodings(request):
+    # Return the content codings accepted by the client (ignoring those with "q=0")
+    res = set()
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, *params = [x.strip() for x in item.split(';')]
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    pass
+        if coding and q > 0:
+            res.add(coding.lower())
+    return res
+
+
+class GzipCompressor:
+    encoding = 'gzip'
+
+    def __init__(self, level):
+        # wbits=31 to write the gzip header and trailer
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def process(self, data):
+        return self._obj.compress(data)
+
+    def flush(self):
+        # the data compressed so far, so that the client can decode it without waiting for more
+        return self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._obj.flush()
+
+
+class BrotliCompressor:
+    encoding = 'br'
+
+    def __init__(self, quality):
+        self._obj = brotli.Compressor(quality=quality)
+
+    def process(self, data):
+        return self._obj.process(data)
+
+    def flush(self):
+        return self._obj.flush()
+
+    def finish(self):
+        return self._obj.finish()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Like django.middleware.gzip.GZipMiddleware, but only for JSON responses
+    (possibly streaming ones, compressed incrementally) larger than
+    MOSURV_COMPRESSION_MIN_SIZE, using brotli if installed and accepted by the client.
+    Responses carrying secrets (see never_compress() and MOSURV_COMPRESSION_EXEMPT_PATHS)
+    are not compressed at all, instead of padding them randomly as GZipMiddleware does.
+    Collects metrics about the compression ratio and the CPU time spent.
+    """
+
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding') or getattr(response, 'never_compress', False):
+            return response
+        if any(re.search(pattern, request.path_info)
+               for pattern in getattr(settings, 'MOSURV_COMPRESSION_EXEMPT_PATHS', EXEMPT_PATHS)):
+            return response
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type not in getattr(settings, 'MOSURV_COMPRESSION_TYPES', COMPRESSIBLE_TYPES):
+            return response
+        if not response.streaming and \
+                len(response.content) < getattr(settings, 'MOSURV_COMPRESSION_MIN_SIZE', 1024):
+            return response
+
+        # the response varies anyway, even if this client does not accept compression
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        compressor = self.get_compressor(request)
+        if compressor is None:
+            return response
+
+        if response.streaming:
+            # flush after each item, so that each one reaches the client as soon as it is produced
+            response.streaming_content = self.compress_sequence(
+                compressor, response.streaming_content, flush=True)
+            # delete the Content-Length header, if any, since it is no more valid
+            del response.headers['Content-Length']
+        else:
+            compressed = self.compress(compressor, [response.content])
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(response.content))
+
+        # the content is now different, so must be any strong ETag, but instead of weakening it
+        # as Django does (that would make it useless for If-Match), add the coding to it
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = f'{etag[:-1]}-{compressor.encoding}"'
+        response.headers['Content-Encoding'] = compressor.encoding
+        return response
+
+    def get_compressor(self, request):
+        accepted = accepted_encodings(request)
+        if brotli is not None and 'br' in accepted:
+            return BrotliCompressor(getattr(settings, 'MOSURV_COMPRESSION_BROTLI_QUALITY', 5))
+        if 'gzip' in accepted:
+            return GzipCompressor(getattr(settings, 'MOSURV_COMPRESSION_GZIP_LEVEL', 6))
+        return None
+
+    def compress(self, compressor, sequence):
+        return b''.join(self.compress_sequence(compressor, sequence))
+
+    def compress_sequence(self, compressor, sequence, flush=False):
+        # only CPU time of this thread (ie: not the time spent waiting for the content) is measured
+        bytes_in = bytes_out = 0
+        cpu = 0.0
+        for item in sequence:
+            start = time.thread_time()
+            data = compressor.process(item)
+            if flush:
+                data += compressor.flush()
+            cpu += time.thread_time() - start
+            bytes_in += len(item)
+            bytes_out += len(data)
+            if data:
+                yield data
+        start = time.thread_time()
+        data = compressor.finish()
+        cpu += time.thread_time() - start
+        bytes_out += len(data)
+        yield data
+
+        prefix = 'compression.' + compressor.encoding
+        metrics.incr(prefix + '.responses')
+        metrics.incr(prefix + '.bytes_in', bytes_in)
+        metrics.incr(prefix + '.bytes_out', bytes_out)
+        metrics.incr(prefix + '.cpu_seconds', cpu)
+        logger.debug('Compressed %s bytes to %s (ratio %.1f) with %s in %.2f ms CPU',
+                     bytes_in, bytes_out, bytes_in / bytes_out if bytes_out else 0,
+                     compressor.encoding, cpu * 1000)
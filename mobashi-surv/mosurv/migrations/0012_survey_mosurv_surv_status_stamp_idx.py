@@ -0,0 +1,19 @@
+# Generated by Django 4.2.5 on 2026-10-18 07:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mosurv", "0011_alter_school_code"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="survey",
+            index=models.Index(
+                fields=["status", "stamp", "id"], name="mosurv_surv_status_stamp_idx"
+            ),
+        ),
+    ]
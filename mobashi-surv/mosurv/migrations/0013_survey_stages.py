@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 07:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mosurv", "0012_survey_mosurv_surv_status_stamp_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="survey",
+            name="stages",
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
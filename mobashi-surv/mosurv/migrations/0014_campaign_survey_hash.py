@@ -0,0 +1,43 @@
+# Generated by Django 4.2.5 on 2026-10-18 07:38
+
+import hashlib
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import migrations, models
+
+
+def fill_survey_hash(apps, schema_editor):
+    # same as mosurv.models.json_hash(), as it was when this migration was written
+    Campaign = apps.get_model("mosurv", "Campaign")
+    for campaign in Campaign.objects.all():
+        data = json.dumps(
+            campaign.survey,
+            cls=DjangoJSONEncoder,
+            sort_keys=True,
+            separators=(",", ":"),
+            ensure_ascii=False,
+        )
+        campaign.survey_hash = hashlib.sha256(data.encode("utf-8")).hexdigest()
+        campaign.save(update_fields=["survey_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mosurv", "0013_survey_stages"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="campaign",
+            name="survey_hash",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                help_text="Hash of the survey definition",
+                max_length=64,
+            ),
+        ),
+        migrations.RunPython(fill_survey_hash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.5 on 2026-10-18 07:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mosurv", "0014_campaign_survey_hash"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="cascho",
+            index=models.Index(
+                fields=["campaign", "school"], name="mosurv_cascho_camp_school_idx"
+            ),
+        ),
+    ]
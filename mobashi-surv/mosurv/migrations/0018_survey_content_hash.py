@@ -0,0 +1,42 @@
+# Generated by Django 4.2.5 on 2026-10-18 07:48
+
+import hashlib
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import migrations, models
+
+
+def fill_content_hash(apps, schema_editor):
+    # same as mosurv.models.json_hash(), as it was when this migration was written
+    Survey = apps.get_model("mosurv", "Survey")
+    batch = []
+    for survey in Survey.objects.only("id", "content").iterator(chunk_size=2000):
+        data = json.dumps(
+            survey.content,
+            cls=DjangoJSONEncoder,
+            sort_keys=True,
+            separators=(",", ":"),
+            ensure_ascii=False,
+        )
+        survey.content_hash = hashlib.sha256(data.encode("utf-8")).hexdigest()
+        batch.append(survey)
+        if len(batch) >= 2000:
+            Survey.objects.bulk_update(batch, ["content_hash"])
+            batch = []
+    Survey.objects.bulk_update(batch, ["content_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mosurv", "0017_updated_at_tombstone"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="survey",
+            name="content_hash",
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.RunPython(fill_content_hash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.5 on 2026-10-18 08:30
+
+from django.db import migrations
+
+
+def clear_stages(apps, schema_editor):
+    # the stored stages had the geo of the School filled in, now it is a placeholder resolved
+    # when harvested: clear them, to be normalized when harvested (as for older Surveys),
+    # until recomputed by the "refresh_stages" command
+    Survey = apps.get_model("mosurv", "Survey")
+    Survey.objects.filter(stages__isnull=False).exclude(stages=[]).update(stages=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mosurv", "0018_survey_content_hash"),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_stages, migrations.RunPython.noop),
+    ]
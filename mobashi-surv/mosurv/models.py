@@ -1,17 +1,35 @@
+import hashlib
+import json
 from collections.abc import Iterable
 from django.conf import settings
 from typing import Any
 from django.db.models.query import QuerySet
 from django.db.models import Q
 from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
 from uuid import uuid4
 import rules
 from rules.contrib.models import RulesModel
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
+from .stages import build_stages, SCHOOL_GEO
+from .rules import is_mosurv_admin
+
+
+def json_hash(value):
+    # hash of a JSON value, independent from the order of the keys of its objects
+    data = json.dumps(value, cls=DjangoJSONEncoder, sort_keys=True,
+                      separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+EMPTY_CONTENT_HASH = json_hash({})
 
 
 class School(RulesModel):
+    # fields used as default origin/destination of trips
+    GEO_FIELDS = ['name', 'address', 'lat', 'lng']
+
     uuid = models.UUIDField(default=uuid4, null=False,
                             # let editable=True for debugging purposes, than set to False
                             blank=True, editable=True, unique=True)
@@ -23,16 +41,18 @@ class School(RulesModel):
                                help_text=_('Complete address of the school'))
     lat = models.FloatField(null=True, blank=True)
     lng = models.FloatField(null=True, blank=True)
+    # for the changes feed (see changes.py)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         verbose_name = _('School')
         verbose_name_plural = _('Schools')
         ordering = ['name']
         rules_permissions = {
-            "add": rules.is_group_member('mosurv_admin'),
-            "change": rules.is_group_member('mosurv_admin'),
-            "delete": rules.is_group_member('mosurv_admin'),
-            "view": rules.is_group_member('mosurv_admin')
+            "add": is_mosurv_admin,
+            "change": is_mosurv_admin,
+            "delete": is_mosurv_admin,
+            "view": is_mosurv_admin
         }
 
     def __str__(self):
@@ -41,8 +61,15 @@ class School(RulesModel):
     def save(self, *args, **kwargs):
         if self._state.adding and not self.uuid:
             self.uuid = uuid4()
+        update_fields = kwargs.get('update_fields', None)
+        if update_fields is not None:
+            kwargs['update_fields'] = [*update_fields, 'updated_at']
         super(School, self).save(*args, **kwargs)
 
+    @property
+    def geo(self):
+        return {name: getattr(self, name) for name in self.GEO_FIELDS}
+
 
 class Campaign(RulesModel):
     class Status(models.IntegerChoices):
@@ -65,18 +92,23 @@ class Campaign(RulesModel):
         through='Cascho',
         help_text=_('Schools this campaign is about'))
     survey = models.JSONField(null=False, blank=True, default=dict)
+    # changes whenever "survey" changes, so that Clients can cache it forever by hash
+    survey_hash = models.CharField(max_length=64, blank=True, editable=False, db_index=True,
+                                   help_text='Hash of the survey definition')
+    # for the changes feed (see changes.py)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         verbose_name = _('Campaign')
         verbose_name_plural = _('Campaigns')
         ordering = ['-stamp_start', '-stamp_end']
         rules_permissions = {
-            "add": rules.is_group_member('mosurv_admin'),
-            "change": rules.is_group_member('mosurv_admin'),
-            "delete": rules.is_group_member('mosurv_admin'),
-            "view": rules.is_group_member('mosurv_admin'),
-            "add_school": rules.is_group_member('mosurv_admin'),
-            "remove_school": rules.is_group_member('mosurv_admin'),
+            "add": is_mosurv_admin,
+            "change": is_mosurv_admin,
+            "delete": is_mosurv_admin,
+            "view": is_mosurv_admin,
+            "add_school": is_mosurv_admin,
+            "remove_school": is_mosurv_admin,
         }
 
     def __str__(self):
@@ -86,8 +118,10 @@ class Campaign(RulesModel):
 
     @property
     def status(self):
+        return self.status_at(timezone.now())
+
+    def status_at(self, now):
         if self.stamp_start and self.stamp_end:
-            now = timezone.now()
             return self.Status.BEFORE if now < self.stamp_start \
                 else self.Status.AFTER if now >= self.stamp_end \
                 else self.Status.ACTIVE
@@ -100,6 +134,11 @@ class Campaign(RulesModel):
     def save(self, *args, **kwargs):
         if self._state.adding and not self.uuid:
             self.uuid = uuid4()
+        self.survey_hash = json_hash(self.survey)
+        update_fields = kwargs.get('update_fields', None)
+        if update_fields is not None:
+            extra = ['survey_hash', 'updated_at'] if 'survey' in update_fields else ['updated_at']
+            kwargs['update_fields'] = [*update_fields, *extra]
         super(Campaign, self).save(*args, **kwargs)
 
     def schools_abbrev(self):
@@ -112,14 +151,59 @@ class Cascho(RulesModel):
         Campaign, related_name='caschos', on_delete=models.CASCADE)
     school = models.ForeignKey(
         School, related_name='caschos', on_delete=models.CASCADE)
+    # for the changes feed (see changes.py)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         db_table = 'mosurv_campaign_schools'
+        indexes = [
+            # for checking if a School is part of a Campaign
+            models.Index(fields=['campaign', 'school'],
+                         name='mosurv_cascho_camp_school_idx'),
+        ]
         rules_permissions = {
-            "add": rules.is_group_member('mosurv_admin'),
-            "change": rules.is_group_member('mosurv_admin'),
-            "delete": rules.is_group_member('mosurv_admin'),
-            "view": rules.is_group_member('mosurv_admin')
+            "add": is_mosurv_admin,
+            "change": is_mosurv_admin,
+            "delete": is_mosurv_admin,
+            "view": is_mosurv_admin
+        }
+
+
+class PooledUser(RulesModel):
+    # Anonymous User (inactive, but already with its Token) ready to be claimed
+    # by an enrollment into the Campaign (see pool.py)
+    campaign = models.ForeignKey(
+        Campaign, related_name='pooled_users', on_delete=models.CASCADE)
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, related_name='+', on_delete=models.CASCADE)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('Pooled user')
+        verbose_name_plural = _('Pooled users')
+        rules_permissions = {
+            "add": is_mosurv_admin,
+            "change": is_mosurv_admin,
+            "delete": is_mosurv_admin,
+            "view": is_mosurv_admin
+        }
+
+
+class Tombstone(RulesModel):
+    # Trace of a deleted School, Campaign or Cascho, for the changes feed (see changes.py)
+    model = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    uuid = models.UUIDField(null=True, blank=True)
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = _('Tombstone')
+        verbose_name_plural = _('Tombstones')
+        rules_permissions = {
+            "add": is_mosurv_admin,
+            "change": is_mosurv_admin,
+            "delete": is_mosurv_admin,
+            "view": is_mosurv_admin
         }
 
 
@@ -127,7 +211,8 @@ class Cascho(RulesModel):
 def is_survey_owner(user: settings.AUTH_USER_MODEL, obj: 'Survey') -> bool:
     if obj is None or not user.is_authenticated:
         return False
-    return obj.user == user
+    # compare ids, so that the User of the Survey is not fetched
+    return obj.user_id == user.pk
 
 
 class Survey(RulesModel):
@@ -156,18 +241,27 @@ class Survey(RulesModel):
     status = models.IntegerField(choices=Status.choices, default=Status.EMPTY)
     stamp = models.DateTimeField(null=True, blank=True, auto_now=True)
     content = models.JSONField(null=False, blank=True, default=dict)
+    # normalized stages of "content", computed on save (None if "content" is not complete)
+    stages = models.JSONField(null=True, blank=True, editable=False)
+    # changes whenever "content" changes, so that saving the same "content" again can be skipped
+    content_hash = models.CharField(max_length=64, blank=True, editable=False)
 
     class Meta:
         verbose_name = _('Survey')
         verbose_name_plural = _('Surveys')
         unique_together = ['kind', 'user', 'campaign', 'school']
         ordering = ['status', 'campaign', 'school', 'kind']
+        indexes = [
+            # for harvesting by keyset on (stamp, id)
+            models.Index(fields=['status', 'stamp', 'id'],
+                         name='mosurv_surv_status_stamp_idx'),
+        ]
         rules_permissions = {
-            # "add": rules.is_group_member('mosurv_admin') | is_survey_owner,
+            # "add": is_mosurv_admin | is_survey_owner,
             "add": rules.always_allow,
-            "change": rules.is_group_member('mosurv_admin') | is_survey_owner,
-            "delete": rules.is_group_member('mosurv_admin'),
-            "view": rules.is_group_member('mosurv_admin') | is_survey_owner
+            "change": is_mosurv_admin | is_survey_owner,
+            "delete": is_mosurv_admin,
+            "view": is_mosurv_admin | is_survey_owner
         }
 
     def __str__(self):
@@ -187,15 +281,48 @@ class Survey(RulesModel):
             if update_fields is None:
                 update_fields = self._meta.get_fields()
             kwargs['update_fields'] = [
-                f.name for f in update_fields if f.name != 'content' and not f.auto_created]
+                f.name for f in update_fields
+                if f.name not in ['content', 'stages', 'content_hash'] and not f.auto_created]
         else:
             self.status = self.Status.FILLED if self.content else self.Status.EMPTY
+            self.refresh_stages()
+            self.content_hash = json_hash(self.content)
+            update_fields = kwargs.get('update_fields', None)
+            if update_fields is not None and 'content' in update_fields:
+                kwargs['update_fields'] = [*update_fields, 'status', 'stages', 'content_hash']
         return super().save(*args, **kwargs)
 
+    def refresh_stages(self):
+        # Normalize stages once here, so that harvesting them is a plain read.
+        # While the Client is still filling the Survey they may be incomplete,
+        # in that case leave them to be normalized when harvested.
+        # The geo of the School is only filled in when harvested, since it may change.
+        try:
+            self.stages = build_stages(self.content, SCHOOL_GEO)
+        except (KeyError, TypeError, ValueError, OverflowError):
+            self.stages = None
+
+    @classmethod
+    def enroll(cls, user, campaign_id, school_id):
+        # Return the "forth" and "back" Surveys of the User, creating them if needed
+        # with a single INSERT ... ON CONFLICT DO NOTHING, so that concurrent requests do not fail
+        kinds = [kind for kind, _ in cls.KIND_CHOICES]
+        # as save() would do, but "content" is empty, so there are no stages
+        cls.objects.bulk_create([
+            cls(kind=kind, user=user, campaign_id=campaign_id, school_id=school_id,
+                stages=[], content_hash=EMPTY_CONTENT_HASH)
+            for kind in kinds
+        ], ignore_conflicts=True)
+        surveys = {obj.kind: obj for obj in cls.objects.select_related('campaign', 'school').filter(
+            kind__in=kinds, user=user, campaign_id=campaign_id, school_id=school_id)}
+        for obj in surveys.values():
+            obj.user = user
+        return [surveys[kind] for kind in kinds]
+
     @classmethod
     def by_user(cls, queryset: QuerySet[Any], user: settings.AUTH_USER_MODEL) -> QuerySet[Any]:
         if not user.is_authenticated:
             return queryset.model.objects.none()
-        if rules.is_superuser(user) | rules.is_group_member('mosurv_admin')(user):
+        if user.is_superuser or is_mosurv_admin(user):
             return queryset
         return queryset.filter(user=user)
@@ -0,0 +1,128 @@
+# Django Rest Framework pagination
+import base64
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# seconds that a transaction may take to commit: "stamp" is set before the commit, so more recent
+# rows are not returned yet, otherwise one committed later with a lower stamp would be missed
+HARVEST_LAG = 10
+
+
+def encode_position(stamp, *keys):
+    # opaque for the clients, but simply base64url of "<stamp>|<key>|..."
+    raw = '|'.join([stamp.isoformat(), *[str(x) for x in keys]])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_position(token, keys=1):
+    # raise ValueError if token is not a valid position with the specified number of keys
+    padding = '=' * (-len(token) % 4)
+    raw = base64.urlsafe_b64decode(token + padding).decode()
+    stamp, *values = raw.split('|')
+    if len(values) != keys:
+        raise ValueError(f'Invalid number of keys in position: {raw}')
+    stamp = parse_datetime(stamp)
+    if stamp is None:
+        raise ValueError(f'Invalid stamp in position: {raw}')
+    return (stamp, *[int(x) for x in values])
+
+
+def get_horizon():
+    # items changed after this may still become visible with an earlier stamp
+    return timezone.now() - timedelta(seconds=getattr(settings, 'MOSURV_HARVEST_LAG', HARVEST_LAG))
+
+
+def before_horizon(queryset, field='stamp'):
+    return queryset.filter(**{f'{field}__lte': get_horizon()})
+
+
+def after_position(queryset, stamp, pk, field='stamp'):
+    # keyset condition equivalent to "(<field>, id) > (%s, %s)"
+    return queryset.filter(Q(**{f'{field}__gt': stamp}) | Q(**{field: stamp, 'id__gt': pk}))
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginate on (stamp, id) with opaque cursors, so that the cost of each page
+    does not depend on its position inside the whole table.
+    Only used if the client asks for it (with a cursor, a watermark or a page size),
+    otherwise the unpaginated list is returned, as older clients expect.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    # the same parameter handled by SinceFilter, that also enables pagination
+    since_query_param = 'since'
+    page_size = 1000
+    max_page_size = 10000
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if not any(name in params for name in (
+                self.cursor_query_param, self.page_size_query_param, self.since_query_param)):
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.watermark = params.get(self.since_query_param) or None
+
+        # "stamp" is always set by Survey.save(), but skip rows never saved since it was added,
+        # and the most recent ones, so that the watermark never skips rows not yet committed
+        queryset = before_horizon(queryset.exclude(stamp__isnull=True)).order_by('stamp', 'id')
+        cursor = params.get(self.cursor_query_param)
+        if cursor:
+            try:
+                stamp, pk = decode_position(cursor)
+            except (TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+            queryset = after_position(queryset, stamp, pk)
+            self.watermark = cursor
+
+        # fetch one more item, to know if there is a next page
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        results = results[:self.page_size]
+        if results:
+            self.watermark = encode_position(results[-1].stamp, results[-1].pk)
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.watermark)
+
+    def get_paginated_response(self, data):
+        # "watermark" must be sent back as "since" on the next run, to only get newer items
+        return Response({
+            'next': self.get_next_link(),
+            'watermark': self.watermark,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'watermark': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
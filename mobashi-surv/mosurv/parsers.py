@@ -0,0 +1,16 @@
+# Django Rest Framework parsers
+from rest_framework.parsers import JSONParser
+
+
+class MergePatchParser(JSONParser):
+    """
+    Parses JSON Merge Patch (RFC 7396) documents, applied by the views that accept them.
+    """
+    media_type = 'application/merge-patch+json'
+
+
+class JSONPatchParser(JSONParser):
+    """
+    Parses JSON Patch (RFC 6902) documents, applied by the views that accept them.
+    """
+    media_type = 'application/json-patch+json'
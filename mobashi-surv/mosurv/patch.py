@@ -0,0 +1,132 @@
+# Patches of JSON documents, to let the Clients only send what changed of a Survey "content":
+# JSON Merge Patch (RFC 7396) and JSON Patch (RFC 6902)
+import copy
+
+
+class PatchError(ValueError):
+    # the patch document is not valid
+    pass
+
+
+class PatchConflict(PatchError):
+    # the patch is valid, but cannot be applied to the document (ie: a "test" failed)
+    pass
+
+
+def merge_patch(target, patch):
+    """
+    Return the result of applying the RFC 7396 merge "patch" to "target" (that is not modified).
+    """
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+    res = dict(target) if isinstance(target, dict) else {}
+    for name, value in patch.items():
+        if value is None:
+            res.pop(name, None)
+        else:
+            res[name] = merge_patch(res.get(name), value)
+    return res
+
+
+def parse_pointer(pointer):
+    # split an RFC 6901 JSON Pointer into its unescaped tokens
+    if not isinstance(pointer, str) or (pointer and not pointer.startswith('/')):
+        raise PatchError(f'Invalid JSON Pointer: {pointer!r}')
+    if not pointer:
+        return []
+    return [x.replace('~1', '/').replace('~0', '~') for x in pointer[1:].split('/')]
+
+
+def get_index(container, token, adding=False):
+    # index of an array, "-" (the end) only allowed when adding
+    if adding and token == '-':
+        return len(container)
+    if not token.isdigit() or (token != '0' and token.startswith('0')):
+        raise PatchConflict(f'Invalid array index: {token!r}')
+    index = int(token)
+    if index > len(container) or (not adding and index == len(container)):
+        raise PatchConflict(f'Array index out of range: {token!r}')
+    return index
+
+
+def resolve(doc, tokens):
+    # return the value pointed to by "tokens" inside "doc"
+    for token in tokens:
+        if isinstance(doc, dict):
+            if token not in doc:
+                raise PatchConflict(f'Missing member: {token!r}')
+            doc = doc[token]
+        elif isinstance(doc, list):
+            doc = doc[get_index(doc, token)]
+        else:
+            raise PatchConflict(f'Cannot traverse a scalar with: {token!r}')
+    return doc
+
+
+def add(doc, tokens, value):
+    if not tokens:
+        return value
+    parent = resolve(doc, tokens[:-1])
+    if isinstance(parent, dict):
+        parent[tokens[-1]] = value
+    elif isinstance(parent, list):
+        parent.insert(get_index(parent, tokens[-1], adding=True), value)
+    else:
+        raise PatchConflict(f'Cannot add to a scalar: {tokens[-1]!r}')
+    return doc
+
+
+def remove(doc, tokens):
+    # return the document and the removed value
+    if not tokens:
+        raise PatchConflict('Cannot remove the whole document')
+    parent = resolve(doc, tokens[:-1])
+    if isinstance(parent, dict):
+        if tokens[-1] not in parent:
+            raise PatchConflict(f'Missing member: {tokens[-1]!r}')
+        return doc, parent.pop(tokens[-1])
+    if isinstance(parent, list):
+        return doc, parent.pop(get_index(parent, tokens[-1]))
+    raise PatchConflict(f'Cannot remove from a scalar: {tokens[-1]!r}')
+
+
+def json_patch(doc, operations):
+    """
+    Return the result of applying the RFC 6902 "operations" to "doc" (that is not modified).
+    Raise PatchError if any operation is not valid and PatchConflict if it cannot be applied,
+    in which case none of them is applied.
+    """
+    if not isinstance(operations, list):
+        raise PatchError('A JSON Patch must be an array of operations')
+    doc = copy.deepcopy(doc)
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise PatchError(f'Invalid operation: {operation!r}')
+        op = operation.get('op')
+        path = parse_pointer(operation.get('path'))
+        if op in ['add', 'replace', 'test'] and 'value' not in operation:
+            raise PatchError(f'Missing "value" in operation: {operation!r}')
+        if op == 'add':
+            doc = add(doc, path, copy.deepcopy(operation['value']))
+        elif op == 'remove':
+            doc, _ = remove(doc, path)
+        elif op == 'replace':
+            resolve(doc, path)  # the target must exist
+            if path:
+                doc, _ = remove(doc, path)
+            doc = add(doc, path, copy.deepcopy(operation['value']))
+        elif op in ['move', 'copy']:
+            source = parse_pointer(operation.get('from'))
+            if op == 'move':
+                if path[:len(source)] == source and path != source:
+                    raise PatchConflict(f'Cannot move a value into itself: {operation!r}')
+                doc, value = remove(doc, source)
+            else:
+                value = copy.deepcopy(resolve(doc, source))
+            doc = add(doc, path, value)
+        elif op == 'test':
+            if resolve(doc, path) != operation['value']:
+                raise PatchConflict(f'Test failed: {operation!r}')
+        else:
+            raise PatchError(f'Invalid operation: {operation!r}')
+    return doc
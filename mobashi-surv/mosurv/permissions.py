@@ -0,0 +1,15 @@
+# Django Rest Framework permissions
+import rules
+from rest_framework.permissions import BasePermission
+from .rules import is_mosurv_admin
+
+
+class IsMosurvAdmin(BasePermission):
+    """
+    Allow access only to superusers and members of the "mosurv_admin" group.
+    """
+
+    def has_permission(self, request, view):
+        user = request.user
+        return bool(user and user.is_authenticated and
+                    (rules.is_superuser | is_mosurv_admin)(user))
@@ -0,0 +1,82 @@
+# Pools of anonymous Users created in advance (see the "fill_pool" command), so that
+# enrollments do not have to create them (with their encrypted fields) and their Tokens
+from uuid import uuid4
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from djoser.conf import settings
+from .authentication import invalidate_user
+from .metrics import metrics
+from .models import PooledUser
+
+# only the fields needed by an enrollment, so that encrypted ones are not decrypted
+USER_FIELDS = ['id', 'username', 'is_active', 'is_staff', 'is_superuser']
+
+metrics.gauge('pool.depth', lambda: PooledUser.objects.count())
+
+# Users that may be concurrently claimed by others before giving up (and creating a new one)
+MAX_CLAIM_ATTEMPTS = 5
+
+
+def claim_user(campaign_id):
+    """
+    Take an User from the pool of the Campaign, activate it and return it with its Token,
+    or return (None, None) if the pool is empty. Must be called inside a transaction.
+    """
+    # SKIP LOCKED, so that concurrent enrollments each get a different User without waiting
+    queryset = PooledUser.objects.select_for_update(skip_locked=True, of=('self',)) \
+        .select_related('user__auth_token') \
+        .only('id', 'user__auth_token__key', *['user__' + name for name in USER_FIELDS]) \
+        .filter(campaign_id=campaign_id).order_by('id')
+    for _ in range(MAX_CLAIM_ATTEMPTS):
+        pooled = queryset.first()
+        if pooled is None:
+            metrics.incr('pool.empty')
+            return None, None
+        # where the row lock is not supported (ie: SQLite) another enrollment may have
+        # already claimed the same User, in which case nothing is deleted: try the next one
+        if PooledUser.objects.filter(pk=pooled.pk).delete()[0] == 1:
+            break
+        metrics.incr('pool.conflicts')
+        queryset = queryset.filter(id__gt=pooled.pk)
+    else:
+        return None, None
+    user = pooled.user
+    get_user_model().objects.filter(pk=user.pk).update(is_active=True)
+    invalidate_user(user.pk)  # update() does not send post_save (see signals.py)
+    user.is_active = True
+    metrics.incr('pool.claimed')
+    return user, user.auth_token
+
+
+def fill_pool(campaign, size, batch=200):
+    """
+    Add to the pool of the Campaign as many Users as needed for it to have "size" of them,
+    creating "batch" of them in each transaction, and return how many were added.
+    """
+    User = get_user_model()
+    Token = settings.TOKEN_MODEL
+    missing = size - PooledUser.objects.filter(campaign=campaign).count()
+    added = 0
+    while added < missing:
+        count = min(batch, missing - added)
+        with transaction.atomic():
+            # as User.objects.create_user() would do, without a password
+            users = User.objects.bulk_create([
+                User(username=str(uuid4()), password=make_password(None), is_active=False)
+                for _ in range(count)
+            ])
+            Token.objects.bulk_create([Token(key=Token.generate_key(), user=user) for user in users])
+            PooledUser.objects.bulk_create([PooledUser(campaign=campaign, user=user) for user in users])
+        added += count
+    return added
+
+
+def prune_pool(campaigns):
+    """
+    Delete the Users still in the pools of the Campaigns, returning how many were deleted.
+    """
+    User = get_user_model()
+    users = User.objects.filter(
+        pk__in=PooledUser.objects.filter(campaign__in=campaigns).values('user_id'))
+    return users.delete()[1].get(User._meta.label, 0)
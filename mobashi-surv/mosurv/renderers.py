@@ -0,0 +1,26 @@
+# Django Rest Framework renderers
+import json
+from rest_framework import renderers
+from rest_framework.utils import encoders
+
+
+class NDJSONRenderer(renderers.BaseRenderer):
+    """
+    Renderer which serializes to newline-delimited JSON (one document per line).
+    Views can also use render_line() to stream items one at a time.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None  # always utf-8 encoded, like JSONRenderer
+    encoder_class = encoders.JSONEncoder
+
+    def render_line(self, item):
+        return json.dumps(item, cls=self.encoder_class, ensure_ascii=False,
+                          separators=(',', ':')).encode('utf-8') + b'\n'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # a single document (ie: an error) still takes one line
+        items = data if isinstance(data, (list, tuple)) else [data]
+        return b''.join(self.render_line(item) for item in items)
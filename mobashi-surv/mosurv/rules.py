@@ -1,3 +1,44 @@
 import rules
+from .caching import get_cache
 
 rules.add_perm('mosurv', rules.always_allow)
+
+# names of the Groups of each User (by pk), so that they are not queried on every request
+# (invalidated, see signals.py, whenever the Groups of a User or the Groups themselves change).
+# Only used if shared (see MOSURV_CACHES): the invalidation of a local one would not reach
+# the other processes, that would keep granting a revoked admin until it expires.
+group_names_cache = get_cache('group_names', maxsize=4096, ttl=60)
+
+
+def get_group_names(user):
+    # also kept on the User instance, as rules.is_group_member() does, so at most once per request
+    res = getattr(user, '_group_names_cache', None)
+    if res is None:
+        res = group_names_cache.get(user.pk) if group_names_cache.shared else None
+        if res is None:
+            res = frozenset(user.groups.values_list('name', flat=True))
+            if group_names_cache.shared:
+                group_names_cache.set(user.pk, res)
+        user._group_names_cache = res
+    return res
+
+
+def invalidate_group_names(user_pk=None):
+    # of the specified User, or of all of them
+    if user_pk is None:
+        group_names_cache.clear()
+    else:
+        group_names_cache.delete(user_pk)
+
+
+def is_group_member(*groups):
+    # same as rules.is_group_member(), but using get_group_names()
+    @rules.predicate(f'is_group_member:{",".join(groups)}')
+    def fn(user):
+        if getattr(user, 'pk', None) is None or not hasattr(user, 'groups'):
+            return False
+        return set(groups).issubset(get_group_names(user))
+    return fn
+
+
+is_mosurv_admin = is_group_member('mosurv_admin')
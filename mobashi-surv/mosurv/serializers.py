@@ -1,30 +1,69 @@
-from dateutil import tz
-from dateutil.parser import parse
-from dateutil.utils import default_tzinfo
+from django.utils import timezone
 from rest_framework import serializers
 from .models import Campaign, School, Cascho, Survey
+from .stages import build_stages, resolve_stages
+from .stamps import StampNormalizer
+
+
+class SharedRepresentationMixin:
+    # When nested, the same object (ie: the Campaign of many Surveys) is represented only once
+    # for all the objects serialized with the same context (ie: in a request)
+    def to_representation(self, instance):
+        if not isinstance(self.parent, serializers.Serializer):
+            return super().to_representation(instance)
+        representations = self.context.setdefault('representations', {})
+        key = (type(self), instance.pk)
+        res = representations.get(key)
+        if res is None:
+            res = representations[key] = super().to_representation(instance)
+        return res
 
 
-class SchoolSerializer(serializers.ModelSerializer):
+class SchoolSerializer(SharedRepresentationMixin, serializers.ModelSerializer):
     class Meta:
         model = School
         fields = '__all__'
 
 
-class GeoSchoolSerializer(serializers.ModelSerializer):
+class GeoSchoolSerializer(SharedRepresentationMixin, serializers.ModelSerializer):
     class Meta:
         model = School
-        fields = ['name', 'address', 'lat', 'lng']
+        fields = School.GEO_FIELDS
+
 
+def campaign_status(context, campaign):
+    # "now" is fixed once for all the objects serialized with the same context (ie: in a request)
+    # and the status of each Campaign is computed only once
+    statuses = context.setdefault('campaign_statuses', {})
+    res = statuses.get(campaign.pk)
+    if res is None:
+        if 'now' not in context:
+            context['now'] = timezone.now()
+        res = statuses[campaign.pk] = campaign.status_at(context['now'])
+    return res
 
-class CampaignSerializer(serializers.ModelSerializer):
-    status = serializers.ReadOnlyField()
-    is_active = serializers.ReadOnlyField()
+
+class CampaignSerializer(SharedRepresentationMixin, serializers.ModelSerializer):
+    status = serializers.SerializerMethodField()
+    is_active = serializers.SerializerMethodField()
 
     class Meta:
         model = Campaign
         fields = '__all__'
 
+    def get_status(self, obj):
+        return campaign_status(self.context, obj)
+
+    def get_is_active(self, obj):
+        return campaign_status(self.context, obj) == Campaign.Status.ACTIVE
+
+
+class CompactCampaignSerializer(CampaignSerializer):
+    # the survey definition is fetched by "survey_hash" from SurveyDefinitionView (and cached)
+    class Meta:
+        model = Campaign
+        exclude = ['survey']
+
 
 class CaschoSerializer(serializers.ModelSerializer):
 
@@ -33,6 +72,16 @@ class CaschoSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class ChangeCaschoSerializer(serializers.ModelSerializer):
+    # the MAIN server only knows Campaigns and Schools by uuid
+    campaign = serializers.ReadOnlyField(source='campaign.uuid')
+    school = serializers.ReadOnlyField(source='school.uuid')
+
+    class Meta:
+        model = Cascho
+        fields = ['id', 'campaign', 'school', 'updated_at']
+
+
 class SurveySerializer(serializers.ModelSerializer):
     campaign = CampaignSerializer(many=False, read_only=True)
     school = SchoolSerializer(many=False, read_only=True)
@@ -44,16 +93,39 @@ class SurveySerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Survey
-        fields = '__all__'
+        exclude = ['stages']
+
+    def is_campaign_active(self, obj):
+        return campaign_status(self.context, obj.campaign) == Campaign.Status.ACTIVE
 
     def get_status(self, obj):
-        return obj.Status.CANCELLED if obj.status in [obj.Status.EMPTY, obj.Status.FILLED] and not obj.campaign.is_active else obj.status
+        return obj.Status.CANCELLED if obj.status in [obj.Status.EMPTY, obj.Status.FILLED] and not self.is_campaign_active(obj) else obj.status
 
     def get_must_fillout(self, obj):
-        return obj.status == obj.Status.EMPTY and obj.campaign.is_active
+        return obj.status == obj.Status.EMPTY and self.is_campaign_active(obj)
 
     def get_can_edit(self, obj):
-        return obj.status in [obj.Status.EMPTY, obj.Status.FILLED] and obj.campaign.is_active
+        return obj.status in [obj.Status.EMPTY, obj.Status.FILLED] and self.is_campaign_active(obj)
+
+
+class CompactSurveySerializer(SurveySerializer):
+    # campaign and school are only referenced, they are sent once in the "included" section
+    campaign = serializers.ReadOnlyField(source='campaign.uuid')
+    school = serializers.ReadOnlyField(source='school.uuid')
+    def_orig = None
+    def_dest = None
+
+
+class SlimSurveySerializer(SurveySerializer):
+    # only what a Client needs after saving the content it already has
+    campaign = None
+    school = None
+    def_orig = None
+    def_dest = None
+
+    class Meta:
+        model = Survey
+        fields = ['id', 'status', 'stamp', 'must_fillout', 'can_edit']
 
 
 class SurveyContentSerializer(serializers.ModelSerializer):
@@ -70,6 +142,19 @@ class SurveyStatusSerializer(serializers.ModelSerializer):
         fields = ['status']
 
 
+class SchoolBulkSerializer(serializers.Serializer):
+    # each School is validated by upsert_schools(), to report all the rejected ones at once
+    schools = serializers.ListField(child=serializers.DictField(), allow_empty=True)
+
+
+class SchoolUuidsSerializer(serializers.Serializer):
+    school_uuids = serializers.ListField(child=serializers.UUIDField(), allow_empty=True)
+
+
+class HarvestAckSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=True)
+
+
 class HarvestSerializer(serializers.ModelSerializer):
     campaign = serializers.ReadOnlyField(source='campaign.uuid')
     school = serializers.ReadOnlyField(source='school.uuid')
@@ -104,29 +189,13 @@ class TripSerializer(serializers.ModelSerializer):
         ]
 
     def get_stages(self, obj):
-        res = []
-        content = obj.content
-        if type(obj.content) is dict:
-            tzone = tz.gettz(content.get('TZ'))
-            def_orig = GeoSchoolSerializer(
-                instance=obj.school, many=False, read_only=True).data
-            def_dest = GeoSchoolSerializer(
-                instance=obj.school, many=False, read_only=True).data
-            orig = content.get('orig') or def_orig or None
-            orig_stamp = content.get('orig_stamp') or None
-            for stage in content.get('stages', []):
-                if not orig or not orig_stamp:
-                    continue
-                if not type(stage) is dict:
-                    continue
-                stage.setdefault('orig', orig)
-                stage.setdefault('orig_stamp', orig_stamp)
-                stage.setdefault('dest', def_dest)
-                orig = stage.get('dest') or None
-                orig_stamp = stage.get('dest_stamp') or None
-                stage['orig_stamp'] = default_tzinfo(
-                    parse(stage['orig_stamp']), tzone).isoformat()
-                stage['dest_stamp'] = default_tzinfo(
-                    parse(stage['dest_stamp']), tzone).isoformat()
-                res.append(stage)
-        return res
+        # share school geo payloads and stamps among all the Surveys in the same request
+        school_geos = self.context.setdefault('school_geos', {})
+        def_geo = school_geos.get(obj.school_id)
+        if def_geo is None:
+            def_geo = school_geos[obj.school_id] = obj.school.geo
+        # normally already computed by Survey.save(), but not for older or incomplete Surveys
+        if obj.stages is not None:
+            return resolve_stages(obj.stages, def_geo)
+        normalizer = self.context.setdefault('stamp_normalizer', StampNormalizer())
+        return build_stages(obj.content, def_geo, normalizer.normalize)
@@ -0,0 +1,62 @@
+# Signal receivers, connected by MosurvConfig.ready()
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.db.models.query import QuerySet
+from django.dispatch import receiver
+from .models import Campaign, School, Cascho, Tombstone
+from .enrollment import invalidate_codes
+from .rules import invalidate_group_names
+from .authentication import invalidate_token, invalidate_user
+from .changes import bulk_recorded
+from djoser.conf import settings as djoser_settings
+
+
+@receiver([post_save, post_delete], sender=Campaign)
+@receiver([post_save, post_delete], sender=School)
+@receiver([post_save, post_delete], sender=Cascho)
+def invalidate_enrollment_codes(sender, **kwargs):
+    invalidate_codes()
+
+
+@receiver(post_delete, sender=Campaign)
+@receiver(post_delete, sender=School)
+@receiver(post_delete, sender=Cascho)
+def create_tombstone(sender, instance, origin=None, **kwargs):
+    # already recorded all at once (see changes.delete_with_tombstones())
+    if bulk_recorded.get() is sender:
+        return
+    # the links of a deleted Campaign or School are implied by its own tombstone
+    if sender is Cascho:
+        origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+        if origin_model in (Campaign, School):
+            return
+    Tombstone.objects.create(model=sender._meta.model_name, object_id=instance.pk,
+                             uuid=getattr(instance, 'uuid', None))
+
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+def invalidate_user_groups(sender, instance, action, reverse, **kwargs):
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    # if changed from the side of the Group, many Users may be involved
+    invalidate_group_names(None if reverse else instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Group)
+def invalidate_groups(sender, **kwargs):
+    # ie: a Group renamed
+    invalidate_group_names()
+
+
+@receiver(post_delete, sender=djoser_settings.TOKEN_MODEL)
+def invalidate_auth_token(sender, instance, **kwargs):
+    # ie: on logout (see djoser.utils.logout_user)
+    invalidate_token(instance.key)
+
+
+@receiver([post_save, post_delete], sender=get_user_model())
+def invalidate_auth_user(sender, instance, created=False, **kwargs):
+    # ie: deactivated, or no more staff
+    if not created:
+        invalidate_user(instance.pk)
@@ -0,0 +1,58 @@
+# Normalization of the stages of a trip, as sent by the Client inside Survey.content
+from .stamps import normalize_stamp, StampNormalizer
+
+# placeholder for the geo of the School in the stages stored by Survey.refresh_stages(),
+# so that they do not become stale when the School changes (see resolve_stages())
+SCHOOL_GEO = {'$ref': 'school'}
+
+
+def build_stages(content, def_geo, normalize=normalize_stamp):
+    """
+    Return the list of stages in "content", each one with its "orig", "orig_stamp"
+    and "dest" filled from the previous stage (or from the defaults), and with
+    stamps converted to ISO 8601 in the "TZ" of the trip, if not specified.
+    "content" is NOT modified.
+    """
+    res = []
+    if type(content) is dict:
+        tzname = content.get('TZ')
+        orig = content.get('orig') or def_geo or None
+        orig_stamp = content.get('orig_stamp') or None
+        for stage in content.get('stages', []):
+            if not orig or not orig_stamp:
+                continue
+            if not type(stage) is dict:
+                continue
+            stage = dict(stage)
+            stage.setdefault('orig', orig)
+            stage.setdefault('orig_stamp', orig_stamp)
+            stage.setdefault('dest', def_geo)
+            orig = stage.get('dest') or None
+            orig_stamp = stage.get('dest_stamp') or None
+            stage['orig_stamp'] = normalize(stage['orig_stamp'], tzname)
+            stage['dest_stamp'] = normalize(stage['dest_stamp'], tzname)
+            res.append(stage)
+    return res
+
+
+def build_stages_many(items):
+    """
+    Same as build_stages() for all the (content, def_geo) pairs in "items",
+    sharing the normalization of stamps among all of them.
+    """
+    normalizer = StampNormalizer()
+    return [build_stages(content, def_geo, normalizer.normalize) for content, def_geo in items]
+
+
+def resolve_stages(stages, def_geo):
+    """
+    Return the stored "stages" with any SCHOOL_GEO placeholder replaced by "def_geo".
+    "stages" are NOT modified.
+    """
+    res = []
+    for stage in stages:
+        names = [name for name in ['orig', 'dest'] if stage.get(name) == SCHOOL_GEO]
+        if names:
+            stage = {**stage, **{name: def_geo for name in names}}
+        res.append(stage)
+    return res
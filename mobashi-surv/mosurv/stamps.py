@@ -0,0 +1,66 @@
+# Normalization of the timestamps sent by the Client
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache
+from dateutil import tz
+from dateutil.parser import parse
+from dateutil.utils import default_tzinfo
+
+
+@lru_cache(maxsize=64)
+def get_tzinfo(name):
+    # tz.gettz() is expensive for names not in its own (small) cache
+    return tz.gettz(name)
+
+
+def parse_stamp(value):
+    # The Client normally sends strict ISO 8601, that is parsed much faster
+    # by the standard library, so only use dateutil for any other format
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    return parse(value)
+
+
+def normalize_stamp(value, tzname):
+    """
+    Return "value" as ISO 8601, in the "tzname" time zone if it has none.
+    """
+    return default_tzinfo(parse_stamp(value), get_tzinfo(tzname)).isoformat()
+
+
+class StampNormalizer:
+    """
+    Normalize many stamps in one go (ie: all those of many Surveys),
+    parsing each distinct (value, tzname) pair only once.
+    Only the "maxsize" most recently used pairs are kept, so that a normalizer
+    living for a whole harvest or export does not grow without limit.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._memo = OrderedDict()
+
+    def normalize(self, value, tzname):
+        key = (value, tzname)
+        try:
+            res = self._memo[key]
+        except KeyError:
+            res = self._memo[key] = normalize_stamp(value, tzname)
+            if len(self._memo) > self.maxsize:
+                self._memo.popitem(last=False)
+            return res
+        except TypeError:  # value is not hashable, so it will fail anyway
+            return normalize_stamp(value, tzname)
+        self._memo.move_to_end(key)
+        return res
+
+
+def normalize_stamps(items):
+    """
+    Return the normalized stamps for all the (value, tzname) pairs in "items".
+    """
+    normalizer = StampNormalizer()
+    return [normalizer.normalize(value, tzname) for value, tzname in items]
@@ -0,0 +1,93 @@
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from .authentication import auth_cache
+from .models import Campaign, School, Cascho, Survey
+from .rules import group_names_cache
+
+
+def make_content(index):
+    return {
+        'TZ': 'Europe/Rome',
+        'orig_stamp': f'2024-04-{index % 28 + 1:02}T08:00:00',
+        'stages': [
+            {'dest': {'lat': 45.1, 'lng': 9.1}, 'dest_stamp': f'2024-04-{index % 28 + 1:02}T08:10:00',
+             'mode': 'bus'},
+            {'dest_stamp': f'2024-04-{index % 28 + 1:02} 08:30', 'mode': 'walk'},
+        ],
+    }
+
+
+class QueryCountTests(APITestCase):
+    """
+    The number of queries of the survey list and of the harvest must not depend
+    on the number of Surveys (nor of their Campaigns and Schools).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        now = timezone.now()
+        cls.admin = User.objects.create_user('main')
+        cls.admin.groups.add(Group.objects.create(name='mosurv_admin'))
+        cls.student = User.objects.create_user('student')
+        campaigns = [Campaign.objects.create(name=f'C{i}', stamp_start=now - timedelta(days=1),
+                                             stamp_end=now + timedelta(days=1)) for i in range(3)]
+        schools = [School.objects.create(name=f'S{i}', lat=45.0, lng=9.0) for i in range(4)]
+        index = 0
+        for campaign in campaigns:
+            for school in schools:
+                Cascho.objects.create(campaign=campaign, school=school)
+                for kind in ['forth', 'back']:
+                    Survey(kind=kind, user=cls.student, campaign=campaign, school=school,
+                           content=make_content(index)).save()
+                    index += 1
+        # Surveys saved before their stages were stored, normalized when harvested
+        Survey.objects.filter(kind='back').update(stages=None)
+        # not changed too recently to be harvested by watermark (see MOSURV_HARVEST_LAG)
+        Survey.objects.update(stamp=now - timedelta(hours=1))
+
+    def setUp(self):
+        auth_cache.clear()
+        group_names_cache.clear()
+
+    def test_survey_list(self):
+        self.client.force_authenticate(self.student)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('survey-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 24)
+
+    def test_survey_list_compact(self):
+        self.client.force_authenticate(self.student)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('survey-list'), {'compact': 'true'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 24)
+        self.assertEqual(len(response.data['included']['campaigns']), 3)
+
+    def test_harvest(self):
+        self.client.force_authenticate(self.admin)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('harvest-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 24)
+
+    def test_harvest_page(self):
+        self.client.force_authenticate(self.admin)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('harvest-list'), {'page_size': 10})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_harvest_stream(self):
+        self.client.force_authenticate(self.admin)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('harvest-list'), {'format': 'ndjson'})
+            lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(lines), 24)
@@ -1,7 +1,8 @@
 # Django Rest Framework url
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CampaignViewSet, SchoolViewSet, CaschoViewSet, SurveyViewSet, HarvestViewSet
+from .views import CampaignViewSet, SchoolViewSet, CaschoViewSet, SurveyViewSet, HarvestViewSet, MetricsView, \
+    SurveyDefinitionView, ChangesView
 
 router = DefaultRouter()
 router.register(r'schools', SchoolViewSet, basename="school")
@@ -12,4 +13,7 @@ router.register(r'harvests', HarvestViewSet, basename='harvest')
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('definitions/<str:survey_hash>/', SurveyDefinitionView.as_view(), name='definition'),
+    path('changes/', ChangesView.as_view(), name='changes'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
@@ -4,27 +4,110 @@ from uuid import uuid4
 from urllib.parse import unquote_plus
 from django.shortcuts import get_object_or_404
 from django.core.exceptions import PermissionDenied
-from django.http.response import HttpResponseServerError, HttpResponseBadRequest, Http404
+from django.http.response import HttpResponseServerError, HttpResponseBadRequest, Http404, StreamingHttpResponse
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+from rest_framework.utils.urls import replace_query_param
 from djoser.conf import settings
-from .models import Campaign, School, Cascho, Survey
+from .models import Campaign, School, Cascho, Survey, json_hash
 from .serializers import CampaignSerializer, SchoolSerializer, CaschoSerializer, \
-    SurveyStatusSerializer, SurveyContentSerializer, SurveySerializer, HarvestSerializer, TripSerializer
+    SurveyStatusSerializer, SurveyContentSerializer, SurveySerializer, HarvestSerializer, TripSerializer, \
+    HarvestAckSerializer, CompactSurveySerializer, CompactCampaignSerializer, SchoolBulkSerializer, \
+    SchoolUuidsSerializer, SlimSurveySerializer
+from .renderers import NDJSONRenderer
+from .parsers import MergePatchParser, JSONPatchParser
+from .patch import merge_patch, json_patch, PatchError, PatchConflict
+from .pagination import KeysetPagination, encode_position
+from .filters import SinceFilter, parse_since
+from .metrics import metrics
+from .middleware import never_compress, strip_etag_coding
+from .permissions import IsMosurvAdmin
+from .enrollment import resolve_code
+from .pool import claim_user
+from .changes import get_changes, serialize_changes, tombstones_horizon
+from .bulk import upsert_schools, link_schools, unlink_schools
+from . import idempotency
 from rules.contrib.rest_framework import AutoPermissionViewSetMixin
 
 
+def parse_etags(header):
+    # ignoring the content coding added by CompressionMiddleware
+    return [strip_etag_coding(x.strip()) for x in header.split(',')]
+
+
+def etag_matches(header, etag):
+    # weak comparison (see RFC 9110), as needed for If-None-Match
+    if not header:
+        return False
+    tags = parse_etags(header)
+    return '*' in tags or etag in [x[2:] if x.startswith('W/') else x for x in tags]
+
+
+def etag_matches_strong(header, etag):
+    # strong comparison (see RFC 9110), as needed for If-Match: weak ETags never match
+    if not header:
+        return False
+    tags = parse_etags(header)
+    return '*' in tags or etag in tags
+
+
+def survey_etag(obj):
+    # changes whenever anything sent back for the Survey changes (even if only because of time)
+    return '"{}"'.format(json_hash([
+        obj.content_hash, obj.status, obj.stamp, obj.campaign.status,
+        obj.campaign.updated_at, obj.school.updated_at,
+        [x.pk for x in obj.campaign.schools.all()],
+    ])[:32])
+
+
+def wants_compact(request):
+    # "?compact=true" (older Clients expect Campaigns and Schools nested in each Survey)
+    return request.query_params.get('compact', '').lower() in ['1', 'true', 'yes']
+
+
+def wants_minimal(request):
+    # "Prefer: return=minimal" (see RFC 7240)
+    prefs = [x.strip().lower() for x in request.META.get('HTTP_PREFER', '').split(',')]
+    return 'return=minimal' in prefs
+
+
+# how the "content" of a Survey is patched, by media type
+PATCHERS = {
+    MergePatchParser.media_type: merge_patch,
+    JSONPatchParser.media_type: json_patch,
+}
+
+
 class SchoolViewSet(AutoPermissionViewSetMixin, viewsets.ModelViewSet):
     serializer_class = SchoolSerializer
     permission_classes = [IsAuthenticated]
     lookup_field = 'uuid'  # instances are modified by the MAIN server
+    permission_type_map = {
+        **AutoPermissionViewSetMixin.permission_type_map,
+        "bulk": "add"
+    }
+    bulk_chunk_size = 1000
 
     def get_queryset(self):
         return School.objects.all()
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        # insert or update (by "uuid") many Schools at once, as sent by the MAIN server
+        serializer = SchoolBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        res = upsert_schools(serializer.validated_data['schools'], chunk_size=self.bulk_chunk_size)
+        return Response(res)
+
 
 class SpecialAutoPermissionViewSetMixin(AutoPermissionViewSetMixin):
     permission_type_map = {
@@ -53,8 +136,19 @@ class CampaignViewSet(SpecialAutoPermissionViewSetMixin, viewsets.ModelViewSet):
         except:
             raise Http404
 
+    def _get_school_uuids(self, request):
+        # list of uuids of the Schools, to add/remove many of them at once, if specified
+        if 'school_uuids' not in request.data:
+            return None
+        serializer = SchoolUuidsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['school_uuids']
+
     @action(detail=True, methods=['patch'])
     def add_school(self, request, uuid=None):
+        school_uuids = self._get_school_uuids(request)
+        if school_uuids is not None:
+            return Response(link_schools(super().get_object(), school_uuids))
         campaign, school = self._get_objs(request, uuid)
         cascho, created = Cascho.objects.get_or_create(
             campaign=campaign, school=school)
@@ -63,6 +157,9 @@ class CampaignViewSet(SpecialAutoPermissionViewSetMixin, viewsets.ModelViewSet):
 
     @action(detail=True, methods=['patch'])
     def remove_school(self, request, uuid=None):
+        school_uuids = self._get_school_uuids(request)
+        if school_uuids is not None:
+            return Response(unlink_schools(super().get_object(), school_uuids))
         campaign, school = self._get_objs(request, uuid)
         cascho = get_object_or_404(Cascho, campaign=campaign, school=school)
         cascho.delete()
@@ -82,10 +179,32 @@ class SurveyViewSet(AutoPermissionViewSetMixin, viewsets.ModelViewSet):
     # create() MUST be accessible by anonymous
     # and other methods are already protected by get_queryset(), that filters by user
     permission_classes = []
+    parser_classes = [*api_settings.DEFAULT_PARSER_CLASSES, MergePatchParser, JSONPatchParser]
 
     def get_queryset(self):
         # will return [] if user not authenticated
-        return Survey.by_user(Survey.objects.all(), self.request.user)
+        queryset = Survey.objects.select_related(
+            'campaign', 'school').prefetch_related('campaign__schools')
+        return Survey.by_user(queryset, self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        # with "?compact=true" each Campaign and School is sent only once, in the "included" section,
+        # while the Surveys only reference them by uuid (older Clients expect them nested, by default)
+        if not wants_compact(request):
+            return super().list(request, *args, **kwargs)
+        surveys = list(self.filter_queryset(self.get_queryset()))
+        results, included = self.get_compact_data(surveys)
+        return Response({'results': results, 'included': included})
+
+    def get_compact_data(self, surveys):
+        # the Surveys referencing their Campaigns and Schools, and each of these only once
+        campaigns = {obj.campaign_id: obj.campaign for obj in surveys}
+        schools = {obj.school_id: obj.school for obj in surveys}
+        context = self.get_serializer_context()
+        return CompactSurveySerializer(surveys, many=True, context=context).data, {
+            'campaigns': CompactCampaignSerializer(campaigns.values(), many=True, context=context).data,
+            'schools': SchoolSerializer(schools.values(), many=True, context=context).data,
+        }
 
     def get_content_serializer(self, *args, **kwargs):
         # Copied and modified from UpdateModelMixin
@@ -94,23 +213,63 @@ class SurveyViewSet(AutoPermissionViewSetMixin, viewsets.ModelViewSet):
         kwargs.setdefault('context', self.get_serializer_context())
         return serializer_class(*args, **kwargs)
 
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag = survey_etag(instance)
+        if etag_matches(request.META.get('HTTP_IF_NONE_MATCH'), etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data, headers={'ETag': etag})
+
     def partial_update(self, request, *args, **kwargs):
         # Copied and modified from UpdateModelMixin
-        instance = self.get_object()  # will raise 404, if get_queryset() returns []
-        # use specific serializer for saving only the content field
-        serializer = self.get_content_serializer(
-            instance, data=request.data, partial=True)
-        serializer.is_valid(raise_exception=True)
-        self.perform_update(serializer)
+        # The "content" can also be patched (see patch.py), sending only what changed,
+        # in which case only the status of the Survey is sent back
+        patcher = PATCHERS.get(request.content_type.split(';')[0].strip().lower())
+        with transaction.atomic():
+            instance = self.get_object()  # will raise 404, if get_queryset() returns []
+            # lock the Survey, so that concurrent updates are checked and applied one after the other
+            # (fetched again, since get_object() is first called outside of any transaction,
+            # to check permissions), keeping the Campaign and School already fetched
+            locked = Survey.objects.select_for_update(of=('self',)).get(pk=instance.pk)
+            locked.campaign, locked.school = instance.campaign, instance.school
+            instance = locked
+            # the Client can ask to update only the version of the Survey it already has
+            if_match = request.META.get('HTTP_IF_MATCH')
+            if if_match and not etag_matches_strong(if_match, survey_etag(instance)):
+                return Response({'error': 'PRECONDITION_FAILED'},
+                                status=status.HTTP_412_PRECONDITION_FAILED,
+                                headers={'ETag': survey_etag(instance)})
+            data = request.data
+            if patcher is not None:
+                try:
+                    data = {'content': patcher(instance.content, request.data)}
+                except PatchConflict as exc:
+                    return Response({'error': 'PATCH_CONFLICT', 'message': str(exc)},
+                                    status=status.HTTP_409_CONFLICT)
+                except PatchError as exc:
+                    raise ValidationError({'content': [str(exc)]})
+            # use specific serializer for saving only the content field
+            serializer = self.get_content_serializer(
+                instance, data=data, partial=True)
+            serializer.is_valid(raise_exception=True)
+            # do not write anything (not even "stamp") if "content" did not change
+            content = serializer.validated_data.get('content', instance.content)
+            if json_hash(content) != instance.content_hash:
+                self.perform_update(serializer)
 
         if getattr(instance, '_prefetched_objects_cache', None):
             # If 'prefetch_related' has been applied to a queryset, we need to
             # forcibly invalidate the prefetch cache on the instance.
             instance._prefetched_objects_cache = {}
 
+        headers = {'ETag': survey_etag(instance)}
+        if patcher is not None or wants_minimal(request):
+            return Response(SlimSurveySerializer(instance, context=self.get_serializer_context()).data,
+                            headers=headers)
         # pass the updated instance to the standard serializer (to send back all fields)
         serializer = self.get_serializer(instance)
-        return Response(serializer.data)
+        return Response(serializer.data, headers=headers)
 
     def get_data(self, request, name):
         encoded = request.data.get(name, '')
@@ -127,6 +286,32 @@ class SurveyViewSet(AutoPermissionViewSetMixin, viewsets.ModelViewSet):
 
     # Can create Surveys only by sending code from Client
     def create(self, request, *args, **kwargs):
+        # Clients retrying with the same "Idempotency-Key" header get the same response,
+        # instead of creating another User each time (see idempotency.py for anonymous ones).
+        # The response carries the auth token, so it must never be compressed, nor stored to be replayed.
+        payload = {name: request.data.get(name) for name in ['code', 'username']}
+        payload['compact'] = wants_compact(request)
+        response = idempotency.begin(request, payload)
+        if response is not None:
+            if response.has_header('Idempotent-Replayed'):
+                response.data = {**response.data, 'token': self.get_replayed_token(request, response)}
+            return never_compress(response)
+        response = None
+        self.enrolled_user = None
+        try:
+            response = never_compress(self.enroll(request, *args, **kwargs))
+            return response
+        finally:
+            idempotency.finish(request, payload, response, secrets=['token'], user=self.enrolled_user)
+
+    def get_replayed_token(self, request, response):
+        # the one used by the request, if any, otherwise that of the User created (or claimed) by it
+        if isinstance(request.auth, settings.TOKEN_MODEL):
+            return request.auth.key
+        token = get_object_or_404(settings.TOKEN_MODEL, user_id=response.idempotent_user_pk)
+        return token.key
+
+    def enroll(self, request, *args, **kwargs):
         try:
             code = self.get_data(request, 'code')
             error = 'Invalid code'
@@ -138,50 +323,56 @@ class SurveyViewSet(AutoPermissionViewSetMixin, viewsets.ModelViewSet):
                 if len(parts) != 2:
                     break
 
-                campaign = get_object_or_404(Campaign, uuid=parts[0])
-                school = get_object_or_404(School, uuid=parts[1])
-
-                if not school in campaign.schools.all():
+                enrollment = resolve_code(parts[0], parts[1])
+                if enrollment is None:
                     break
 
-                # if user is authenticated, its "username" must coincide with the one specified and it must have a token
-                # if it's not authenticated and a username is specified, get the corresponding user, that must exists and have a token
-                # if a username is not specified, create a new user and corresponding token
-                # in any case do not let an admin or inactive User in
-                username = self.get_data(request, 'username')
-                user = request.user
-                token = None
-                if user.is_authenticated:
-                    if user.username != username:
+                # all or nothing, so that a failed request leaves no User without Surveys
+                with transaction.atomic():
+                    # if user is authenticated, its "username" must coincide with the one specified and it must have a token
+                    # if it's not authenticated and a username is specified, get the corresponding user, that must exists and have a token
+                    # if a username is not specified, create a new user and corresponding token
+                    # in any case do not let an admin or inactive User in
+                    username = self.get_data(request, 'username')
+                    user = request.user
+                    token = None
+                    if user.is_authenticated:
+                        if user.username != username:
+                            raise PermissionDenied
+                        token = get_object_or_404(settings.TOKEN_MODEL, user=user)
+                    else:
+                        User = get_user_model()
+                        if username:
+                            user = get_object_or_404(User, username=username)
+                            token = get_object_or_404(
+                                settings.TOKEN_MODEL, user=user)
+                        else:
+                            # take one already created in advance, if any
+                            user, token = claim_user(enrollment.campaign_id)
+                            if user is None:
+                                username = uuid4()
+                                user = User.objects.create_user(username)
+                                token = settings.TOKEN_MODEL.objects.create(user=user)
+
+                    if user.is_staff or user.is_superuser or not user.is_active:
                         raise PermissionDenied
-                    token = get_object_or_404(settings.TOKEN_MODEL, user=user)
+
+                    forth, back = Survey.enroll(user, enrollment.campaign_id, enrollment.school_id)
+                    self.enrolled_user = user
+
+                # both Surveys serialize the same Campaign with its Schools
+                prefetch_related_objects([forth.campaign, back.campaign], 'schools')
+                if wants_compact(request):
+                    # as list() does, the Campaign and the School are sent only once
+                    surveys, included = self.get_compact_data([forth, back])
+                    data = {'surveys': surveys, 'included': included}
                 else:
-                    User = get_user_model()
-                    if username:
-                        user = get_object_or_404(User, username=username)
-                        token = get_object_or_404(
-                            settings.TOKEN_MODEL, user=user)
-                    else:
-                        username = uuid4()
-                        user = User.objects.create_user(username)
-                        token = settings.TOKEN_MODEL.objects.create(user=user)
-
-                if user.is_staff or user.is_superuser or not user.is_active:
-                    raise PermissionDenied
-
-                forth, forth_created = Survey.objects.get_or_create(
-                    kind='forth', user=user, campaign=campaign, school=school)
-                back, back_created = Survey.objects.get_or_create(
-                    kind='back', user=user, campaign=campaign, school=school)
-
-                context = self.get_serializer_context()
-                serializer_class = self.get_serializer_class()
-                serializer = serializer_class(
-                    [forth, back], many=True, context=context)
-                data = {
-                    'surveys': serializer.data,
-                    'token': token.key if token else None
-                }
+                    context = self.get_serializer_context()
+                    serializer_class = self.get_serializer_class()
+                    serializer = serializer_class(
+                        [forth, back], many=True, context=context)
+                    data = {'surveys': serializer.data}
+                data['token'] = token.key if token else None
                 return Response(data)
 
             if error:
@@ -195,15 +386,60 @@ class SurveyViewSet(AutoPermissionViewSetMixin, viewsets.ModelViewSet):
             }, status=HttpResponseServerError.status_code)
 
 
+class SurveyDefinitionView(APIView):
+    # A survey definition never changes for a given hash, so it can be cached forever
+    # by Clients and reverse proxies (it contains no personal data, so anyone may get it)
+    permission_classes = []
+    cache_control = 'public, max-age=31536000, immutable'
+
+    def get(self, request, survey_hash, *args, **kwargs):
+        survey = Campaign.objects.filter(survey_hash=survey_hash) \
+            .values_list('survey', flat=True).first()
+        if survey is None:
+            raise Http404
+        etag = f'"{survey_hash}"'
+        headers = {'ETag': etag, 'Cache-Control': self.cache_control}
+        if etag_matches(request.META.get('HTTP_IF_NONE_MATCH'), etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(survey, headers=headers)
+
+
 class HarvestViewSet(AutoPermissionViewSetMixin, viewsets.ModelViewSet):
     # serializer_class = HarvestSerializer
     serializer_class = TripSerializer
     permission_classes = [IsAuthenticated]
+    # with "?format=ndjson" or "Accept: application/x-ndjson" list() streams one trip per line
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer]
+    # with "?since=<watermark>" only trips changed after the previous harvest are returned
+    filter_backends = [SinceFilter]
+    pagination_class = KeysetPagination
+    stream_chunk_size = 500
+    permission_type_map = {
+        **AutoPermissionViewSetMixin.permission_type_map,
+        "ack": "change",
+    }
 
     def get_queryset(self):
-        res = Survey.by_user(Survey.objects.all(), self.request.user)
+        res = Survey.by_user(Survey.objects.select_related('campaign', 'school'), self.request.user)
         return res.filter(status=Survey.Status.FILLED)
 
+    def list(self, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        if not isinstance(renderer, NDJSONRenderer):
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        return StreamingHttpResponse(self.stream_trips(queryset, renderer),
+                                     content_type=renderer.media_type)
+
+    def stream_trips(self, queryset, renderer):
+        # iterator() uses a server-side cursor (on PostgreSQL), so that only
+        # one chunk of Surveys at a time is kept in memory
+        serializer_class = self.get_serializer_class()
+        context = self.get_serializer_context()
+        for obj in queryset.iterator(chunk_size=self.stream_chunk_size):
+            serializer = serializer_class(obj, many=False, context=context)
+            yield renderer.render_line(serializer.data)
+
     def get_status_serializer(self, *args, **kwargs):
         # Copied and modified from UpdateModelMixin
         # to use a serializer that only saves the "status" field
@@ -228,3 +464,63 @@ class HarvestViewSet(AutoPermissionViewSetMixin, viewsets.ModelViewSet):
         # pass the updated instance to the standard serializer (to send back all fields)
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
+
+    @action(detail=False, methods=['post'])
+    def ack(self, request):
+        # Mark all the specified Surveys as USED at once, instead of one PATCH for each of them.
+        # Surveys not accessible by the user or not FILLED are rejected.
+        serializer = HarvestAckSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = set(serializer.validated_data['ids'])
+        with transaction.atomic():
+            found = set(self.get_queryset().filter(id__in=ids).select_for_update(of=('self',))
+                        .values_list('id', flat=True))
+            # same as Survey.save() would do, but with a single UPDATE
+            updated = Survey.objects.filter(id__in=found).update(
+                status=Survey.Status.USED, stamp=timezone.now())
+        return Response({
+            'requested': len(ids),
+            'updated': updated,
+            'rejected': sorted(ids - found),
+        })
+
+
+class ChangesView(APIView):
+    """
+    Changes (and deletions) of Schools, Campaigns and links between them, in order,
+    after the watermark specified by "since" (as returned by the previous call, or a plain
+    ISO 8601 timestamp), paginated as KeysetPagination does.
+    """
+    permission_classes = [IsMosurvAdmin]
+    pagination_class = KeysetPagination
+
+    def get(self, request, *args, **kwargs):
+        since = request.query_params.get('since')
+        # before any change with the stamp, if a plain timestamp
+        position = parse_since(since, lowest=(-1, 0)) if since else None
+        if position is not None and position[0] < tombstones_horizon():
+            # deletions before then may have been pruned, so a full sync is needed
+            return Response({
+                'error': 'WATERMARK_EXPIRED',
+                'message': 'Changes before the watermark are no longer available'
+            }, status=status.HTTP_410_GONE)
+        page_size = self.pagination_class().get_page_size(request)
+
+        # fetch one more item, to know if there is a next page
+        changes = get_changes(position, page_size + 1)
+        has_next = len(changes) > page_size
+        changes = changes[:page_size]
+        watermark = encode_position(*changes[-1][0]) if changes else since or None
+        return Response({
+            'next': replace_query_param(request.build_absolute_uri(), 'since', watermark) if has_next else None,
+            'watermark': watermark,
+            'results': serialize_changes(changes, context={'request': request}),
+        })
+
+
+class MetricsView(APIView):
+    # in-process metrics, so only those of the worker that serves the request
+    permission_classes = [IsMosurvAdmin]
+
+    def get(self, request, *args, **kwargs):
+        return Response(metrics.snapshot())
@@ -96,6 +96,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "corsheaders.middleware.CorsMiddleware",
+    # must come before any middleware that reads or changes the response content
+    "mosurv.middleware.CompressionMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -203,11 +205,42 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         # PAOLO - La Token deve essere elencata prima della Session altrimenti ci sono problemi di CSRF
-        'rest_framework.authentication.TokenAuthentication',
+        'mosurv.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ]
 }
 
+# Compress JSON responses larger than this (in bytes), with brotli if installed, otherwise gzip
+MOSURV_COMPRESSION_MIN_SIZE = 1024
+MOSURV_COMPRESSION_GZIP_LEVEL = 6
+MOSURV_COMPRESSION_BROTLI_QUALITY = 5
+# responses of these paths carry auth tokens, so they are never compressed (BREACH)
+MOSURV_COMPRESSION_EXEMPT_PATHS = [r'^/auth/token/']
+
+# Harvests and the changes feed skip what changed in the last seconds, so that the watermark
+# returned never gets ahead of transactions not yet committed (their "stamp" is set before)
+MOSURV_HARVEST_LAG = 10
+
+# Deletions are traced in the changes feed for this many days (see the "prune_tombstones" command),
+# older watermarks are rejected, so that the MAIN server syncs all again
+MOSURV_TOMBSTONES_DAYS = 90
+
+# Caches are local to each process (ie: gunicorn worker) by default, but can be shared
+# by all of them, using one of the Django CACHES (ie: Redis or Memcached), for example:
+# MOSURV_CACHES = {
+#     'enrollment_codes': {'BACKEND': 'shared', 'ALIAS': 'default', 'TTL': 300},
+#     # responses replayed for the same Idempotency-Key: REQUIRED with more than one worker,
+#     # since retries may reach any of them (a local one only recognizes retries to the same worker)
+#     'idempotency': {'BACKEND': 'shared', 'ALIAS': 'default', 'TTL': 24 * 3600},
+#     # Groups of each User, for permissions (only cached across requests if shared, since
+#     # a local one would be invalidated only in its own process)
+#     'group_names': {'BACKEND': 'shared', 'ALIAS': 'default', 'TTL': 60},
+#     # Users of the Tokens (logout and deactivation reach other processes only if shared,
+#     # so a local one only keeps them for a few seconds)
+#     'auth_tokens': {'BACKEND': 'shared', 'ALIAS': 'default', 'TTL': 300},
+# }
+MOSURV_CACHES = {}
+
 DJOSER = {
     'PASSWORD_RESET_CONFIRM_URL': '#/password/reset/confirm/{uid}/{token}',
     'USERNAME_RESET_CONFIRM_URL': '#/username/reset/confirm/{uid}/{token}',
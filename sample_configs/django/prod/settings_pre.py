@@ -21,5 +21,14 @@ CORS_ALLOW_HEADERS = (
     *default_headers,
     'origin',
     'accept-encoding',
+    'idempotency-key',
+    'prefer',
+    'if-match',
+    'if-none-match',
+)
+
+# so that Clients can send them back as If-Match/If-None-Match
+CORS_EXPOSE_HEADERS = (
+    'etag',
 )
 
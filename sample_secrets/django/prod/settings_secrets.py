@@ -1,3 +1,6 @@
 SECRET_KEY = "<AVERYSECRETKEY>"
+# key of the blind indexes of the encrypted fields of the Users, otherwise derived from SECRET_KEY
+# (after changing it, run "manage.py build_blind_indexes")
+CUSTOM_USER_BLIND_INDEX_KEY = "<ANOTHERSECRETKEY>"
 
 